@@ -0,0 +1,22 @@
+from urllib.parse import urlsplit, parse_qsl, urlencode, urlunsplit
+
+from config import DATABASE_URL, DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE
+
+POSTGRES_SCHEMES = ('postgres', 'asyncpg', 'psycopg')
+
+
+def database_url(url: str = DATABASE_URL) -> str:
+    # Postgres connections come from a pool, sizes given in the url itself are kept
+    parts = urlsplit(url)
+    if parts.scheme not in POSTGRES_SCHEMES:
+        return url
+    query = dict(parse_qsl(parts.query))
+    query.setdefault('minsize', str(DB_POOL_MIN_SIZE))
+    query.setdefault('maxsize', str(DB_POOL_MAX_SIZE))
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+TORTOISE_ORM = {
+    'connections': {'default': database_url()},
+    'apps': {'models': {'models': ['data.models'], 'default_connection': 'default'}},
+}
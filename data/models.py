@@ -1,9 +1,15 @@
+from collections import Counter
 from datetime import timedelta
 
-from aioredis import Redis
 from tortoise import Model, fields
 from tortoise.exceptions import ValidationError
 
+from data.offers import offers
+from engine import Board, WHITE, BLACK, QUEEN, INITIAL_BOARD, CHECKMATE, STALEMATE, square, find_legal_move, game_status
+
+INITIAL_HASH = Board.from_string(INITIAL_BOARD).hash
+MOVE_SNAPSHOT_INTERVAL = 32  # every n-th logged move also stores the board
+
 
 class User(Model):
     username = fields.CharField(unique=True, max_length=15)
@@ -18,6 +24,10 @@ class User(Model):
     is_admin = fields.BooleanField(default=False)
     is_super_admin = fields.BooleanField(default=False)
     playing_now = fields.BooleanField(default=False)
+    rating = fields.FloatField(default=1500)  # Elo, updated after every game
+    glicko_rating = fields.FloatField(default=1500)  # Glicko-2, updated once per rating period
+    glicko_deviation = fields.FloatField(default=350)
+    glicko_volatility = fields.FloatField(default=0.06)
 
     async def update_status(self, offline=False, online=False):
         if online:
@@ -27,31 +37,20 @@ class User(Model):
             self.playing_now = False
         else:
             raise ValueError('You must to set is_active to True or False')
-        await self.save()
+        # Only the status fields, game counters are incremented in the database by the result commit
+        await self.save(update_fields=('is_active', 'playing_now'))
 
     async def get_swiss_system_rating(self):
         return self.wins + (self.all_games - self.losses - self.wins) * 0.5
 
-    async def get_offers(self, redis: Redis):
-        offers = await redis.get(f'offer:{self.pk}')
-        return list(map(int, offers.decode('utf-8').split(':'))) if offers else []
+    async def get_offers(self) -> list[int]:
+        return await offers.get(self.pk)
 
-    async def add_offer(self, inviter_user, redis: Redis):
-        offers = await redis.get(f'offer:{self.pk}')
-        if offers:
-            offers = offers.decode('utf-8')
-            offers += ':' + str(inviter_user.pk)
-        else:
-            offers = str(inviter_user.pk)
-        await redis.set(f'offer:{self.pk}', offers, ex=timedelta(minutes=5))
+    async def add_offer(self, inviter_user) -> int:
+        return await offers.add(self.pk, inviter_user.pk)
 
-    async def remove_offer(self, inviter_user, redis: Redis):
-        await redis.set(
-            f'offer:{self.pk}',
-            ':'.join(filter(lambda x: x != str(inviter_user.pk),
-                            (await redis.get(f'offer:{self.pk}')).decode('utf-8').split(':'))),
-            ex=timedelta(minutes=5)
-        )
+    async def remove_offer(self, inviter_user) -> bool:
+        return await offers.take(self.pk, inviter_user.pk)
 
 
 class Tournament(Model):
@@ -59,6 +58,7 @@ class Tournament(Model):
     owner = fields.ForeignKeyField('models.User')
     created_at = fields.DatetimeField(auto_now_add=True)
     finishing_at = fields.DatetimeField()
+    round = fields.IntField(default=0)  # number of rounds paired so far
 
 
 class TournamentParticipant(Model):
@@ -67,16 +67,15 @@ class TournamentParticipant(Model):
     all_games = fields.IntField(default=0)
     wins = fields.IntField(default=0)
     losses = fields.IntField(default=0)
+    had_bye = fields.BooleanField(default=False)  # a bye counts as a win
 
 
 class Match(Model):
-    white_player = fields.ForeignKeyField('models.User', related_name='white_player')
-    black_player = fields.ForeignKeyField('models.User', related_name='black_player')
-    tournament = fields.ForeignKeyField('models.Tournament', null=True)
+    white_player = fields.ForeignKeyField('models.User', related_name='white_player', index=True)
+    black_player = fields.ForeignKeyField('models.User', related_name='black_player', index=True)
+    tournament = fields.ForeignKeyField('models.Tournament', null=True, index=True)
     # 1-King 2-Queen 3-Rook 4-Bishop 5-Knight 6-Pawn
-    board = fields.TextField(
-        default="1113121513141412151116141715181321162216231624162516261627162816"
-                "-8123822583248422852186248725882371267226732674267526762677267826")
+    board = fields.TextField(default=INITIAL_BOARD)
     # Example:
     # 1413 -> 14 means: Coordinates: 1D, 13 means: 1 is white piece 3 is Rook
     # 2526 -> 25 is Coordinates 2E, next 2 mean is black piece 6 is Pawn
@@ -84,190 +83,183 @@ class Match(Model):
     started_at = fields.DatetimeField(auto_now_add=True)
     finished_at = fields.DatetimeField(null=True)
     now_turn = fields.IntField(default=1)
-    during_1 = fields.TimeDeltaField()
-    during_2 = fields.TimeDeltaField()
-    winner = fields.IntField(default=-1)  # -1 means is during, 0-draw, 1-white_player was won 2-black_player was won
-
-    async def move(self, from_at: str, to_at: str):
-        from_idx = self.chess_notation_to_index(from_at)
-        to_idx = self.chess_notation_to_index(to_at)
-
-        piece = self.board[from_idx:from_idx + 2]
-        if piece[1] == '0':
+    during_1 = fields.TimeDeltaField()  # remaining time of white_player
+    during_2 = fields.TimeDeltaField()  # remaining time of black_player
+    increment = fields.TimeDeltaField(default=timedelta(0))  # added to the mover's time after every move
+    winner = fields.IntField(default=-1, index=True)  # -1 means is during, 0-draw, 1-white_player was won 2-black_player was won
+    position_hash = fields.BigIntField(default=INITIAL_HASH)  # Zobrist key of board + now_turn
+    plies = fields.IntField(default=0)  # number of moves in the MatchMove log
+
+    @property
+    def position(self) -> Board:
+        cached = getattr(self, '_position', None)
+        if cached is None or cached[0] != self.board or cached[1].turn != self.now_turn:
+            # Castling rights, en passant and earlier positions are unknown here, restore_position recovers them
+            position = Board.from_string(self.board, self.now_turn)
+            cached = self._position = (self.board, position)
+            # Occurrences of each position hash
+            self._repetitions = Counter({position.hash: 1})
+        return cached[1]
+
+    async def restore_position(self):
+        # Replays the move log, so a reloaded match keeps its castling rights, en passant square and repetitions.
+        # Matches with an incomplete log keep the position built from the board string
+        moves = await MatchMove.filter(match_id=self.pk, ply__lte=self.plies).order_by('ply').values_list(
+            'move', flat=True)
+        if len(moves) != self.plies:
+            return
+        position = Board.from_string(INITIAL_BOARD)
+        repetitions = Counter({position.hash: 1})
+        for move in moves:
+            position.make_move(move)
+            repetitions[position.hash] += 1
+        if position.turn != self.now_turn or position.to_string() != Board.from_string(self.board).to_string():
+            return
+        self._position = (self.board, position)
+        self._repetitions = repetitions
+
+    def remaining(self, color: int) -> timedelta:
+        return self.during_1 if color == WHITE else self.during_2
+
+    def clock_state(self) -> dict:
+        # Remaining seconds of both players as of the last move, sent to clients with every move
+        return {'during_1': self.during_1.total_seconds(), 'during_2': self.during_2.total_seconds(),
+                'increment': self.increment.total_seconds()}
+
+    def charge_clock(self, elapsed: timedelta) -> bool:
+        # Takes the thinking time from the side to move and adds the increment, False when its flag fell
+        remaining = self.remaining(self.now_turn) - elapsed
+        if remaining <= timedelta(0):
+            remaining = timedelta(0)
+        else:
+            remaining += self.increment
+        if self.now_turn == WHITE:
+            self.during_1 = remaining
+        else:
+            self.during_2 = remaining
+        return remaining > timedelta(0)
+
+    async def move(self, from_at: str, to_at: str, promotion: int = QUEEN, elapsed: timedelta = None):
+        status = self.apply_move(from_at, to_at, promotion, elapsed)
+        if status is None:
+            await self.save()
+            await self.save_moves()
+        return status
+
+    def apply_move(self, from_at: str, to_at: str, promotion: int = QUEEN, elapsed: timedelta = None) -> str | None:
+        # Validates and plays the move in memory, returns the game result text once the game is over.
+        # elapsed is the mover's thinking time, charged to its clock
+        position = self.position
+        try:
+            from_sq, to_sq = square(from_at), square(to_at)
+        except (ValueError, IndexError):
+            raise ValidationError("Invalid square.")
+
+        color, piece = position.piece_at(from_sq)
+        if not piece:
             raise ValidationError("No piece at the source location.")
 
-        if self.now_turn == 1 and piece[0] != '1':
+        if self.now_turn == WHITE and color != WHITE:
             raise ValidationError("It's white's turn.")
-        elif self.now_turn == 2 and piece[0] != '2':
+        elif self.now_turn == BLACK and color != BLACK:
             raise ValidationError("It's black's turn.")
 
-        # Validate the move
-        if not self._validate_move(piece, from_idx, to_idx):
+        # Validate the move, a move leaving own king in check is not allowed
+        move = find_legal_move(position, from_sq, to_sq, promotion)
+        if move < 0:
             raise ValidationError("Invalid move.")
 
+        # The move is not played when the mover's flag has already fallen
+        if elapsed is not None and not self.charge_clock(elapsed):
+            return "Time is over!"
+
         # Update the board
-        new_board = list(self.board)
-        new_board[from_idx:from_idx + 2] = '00'  # Empty the source cell
-        new_board[to_idx:to_idx + 2] = piece  # Move the piece to the destination cell
-        self.board = "".join(new_board)
+        position.make_move(move)
+        self.board = position.to_string()
+        self.position_hash = position.hash
+        self._position = (self.board, position)
+        self._repetitions[position.hash] += 1
+        self._log_move(move)
 
         # Update the turn
-        self.now_turn = 2 if self.now_turn == 1 else 1
+        self.now_turn = position.turn
 
-        # Check for checkmate or stalemate
-        if self._is_checkmate(self.now_turn):
+        # Check for checkmate, stalemate or threefold repetition
+        status = game_status(position)
+        if status == CHECKMATE:
             return "Checkmate!"
-        elif self._is_stalemate(self.now_turn):
+        elif status == STALEMATE:
             return "Stalemate!"
-
-        await self.save()
-
-    def _is_check(self, color: str) -> bool:
-        king_position = self._find_king(color)
-        return self._is_position_under_threat(king_position, '1' if color == '2' else '2')
-
-    def _is_checkmate(self, color: str) -> bool:
-        if not self._is_check(color):
-            return False
-        return not self._has_legal_moves(color)
-
-    def _is_stalemate(self, color: str) -> bool:
-        if self._is_check(color):
-            return False
-        return not self._has_legal_moves(color)
-
-    def _has_legal_moves(self, color: str) -> bool:
-        for from_idx in range(0, len(self.board), 2):
-            piece = self.board[from_idx:from_idx + 2]
-            if piece[0] == color:
-                for to_idx in range(0, len(self.board), 2):
-                    if self._validate_move(piece, from_idx, to_idx):
-                        # Perform the move and check if it resolves the check
-                        temp_board = list(self.board)
-                        temp_board[to_idx:to_idx + 2] = piece
-                        temp_board[from_idx:from_idx + 2] = '00'
-                        temp_board = "".join(temp_board)
-                        if not self._is_check(color):
-                            return True
-        return False
-
-    def _find_king(self, color: str) -> int:
-        for idx in range(0, len(self.board), 2):
-            piece = self.board[idx:idx + 2]
-            if piece[0] == color and piece[1] == '1':  # '1' represents the King
-                return idx
-        return -1
-
-    def _is_position_under_threat(self, position: int, opponent_color: str) -> bool:
-        for idx in range(0, len(self.board), 2):
-            piece = self.board[idx:idx + 2]
-            if piece[0] == opponent_color:
-                if self._validate_move(piece, idx, position):
-                    return True
-        return False
-
-    @staticmethod
-    def chess_notation_to_index(notation: str) -> int:
-        file = notation[0].upper()
-        rank = notation[1]
-
-        files = {'A': 1, 'B': 2, 'C': 3, 'D': 4, 'E': 5, 'F': 6, 'G': 7, 'H': 8}
-        return (int(rank) - 1) * 8 * 2 + (files[file] - 1) * 2
-
-    def _validate_move(self, piece: str, from_idx: int, to_idx: int) -> bool:
-        piece_type = int(piece[1])
-
-        if piece_type == 1:  # King
-            return self._validate_king_move(from_idx, to_idx)
-        elif piece_type == 2:  # Queen
-            return self._validate_queen_move(from_idx, to_idx)
-        elif piece_type == 3:  # Rook
-            return self._validate_rook_move(from_idx, to_idx)
-        elif piece_type == 4:  # Bishop
-            return self._validate_bishop_move(from_idx, to_idx)
-        elif piece_type == 5:  # Knight
-            return self._validate_knight_move(from_idx, to_idx)
-        elif piece_type == 6:  # Pawn
-            return self._validate_pawn_move(piece[0], from_idx, to_idx)
-
-        return False
-
-    def _validate_king_move(self, from_idx: int, to_idx: int) -> bool:
-        row_diff = abs((from_idx // 2) // 8 - (to_idx // 2) // 8)
-        col_diff = abs((from_idx // 2) % 8 - (to_idx // 2) % 8)
-        return row_diff <= 1 and col_diff <= 1 and not self._is_same_color(from_idx, to_idx)
-
-    def _validate_queen_move(self, from_idx: int, to_idx: int) -> bool:
-        return (self._validate_rook_move(from_idx, to_idx) or
-                self._validate_bishop_move(from_idx, to_idx))
-
-    def _validate_rook_move(self, from_idx: int, to_idx: int) -> bool:
-        if self._is_same_color(from_idx, to_idx):
-            return False
-        from_row, from_col = (from_idx // 2) // 8, (from_idx // 2) % 8
-        to_row, to_col = (to_idx // 2) // 8, (to_idx // 2) % 8
-        if from_row == to_row:
-            step = 2 if from_col < to_col else -2
-            for col in range(from_col + step, to_col, step):
-                if self.board[from_row * 16 + col * 2: from_row * 16 + col * 2 + 2] != '00':
-                    return False
-        elif from_col == to_col:
-            step = 16 if from_row < to_row else -16
-            for row in range(from_row * 16 + step, to_row * 16, step):
-                if self.board[row + from_col * 2: row + from_col * 2 + 2] != '00':
-                    return False
+        elif self._repetitions[position.hash] >= 3:
+            return "Draw by repetition!"
+
+    def _log_move(self, move: int):
+        self.plies += 1
+        snapshot = None
+        if self.plies % MOVE_SNAPSHOT_INTERVAL == 0:
+            # 'board|castling rights|en passant square', the board string alone does not hold the last two
+            position = self._position[1]
+            snapshot = f'{self.board}|{position.castling}|{position.ep_square}'
+        if not hasattr(self, '_pending_moves'):
+            self._pending_moves = []
+        self._pending_moves.append(MatchMove(match_id=self.pk, ply=self.plies, move=move, snapshot=snapshot))
+
+    def take_pending_moves(self) -> list['MatchMove']:
+        # Logged moves not written yet, the caller writes them or hands them back with restore_pending_moves
+        moves = getattr(self, '_pending_moves', [])
+        self._pending_moves = []
+        return moves
+
+    def restore_pending_moves(self, moves: list['MatchMove']):
+        self._pending_moves[:0] = moves
+
+    async def save_moves(self):
+        # Appends the moves played since the last call to the log
+        moves = self.take_pending_moves()
+        if moves:
+            try:
+                await MatchMove.bulk_create(moves)
+            except Exception:
+                self.restore_pending_moves(moves)
+                raise
+
+    async def replay(self, ply: int = None) -> Board:
+        # Rebuilds the position after the given ply from the closest snapshot and the logged moves after it
+        ply = self.plies if ply is None else ply
+        snapshot = await MatchMove.filter(
+            match_id=self.pk, ply__lte=ply, snapshot__isnull=False).order_by('-ply').first()
+        if snapshot:
+            board, _, state = snapshot.snapshot.partition('|')
+            turn = WHITE if snapshot.ply % 2 == 0 else BLACK
+            if state:
+                castling, ep_square = map(int, state.split('|'))
+                position = Board.from_string(board, turn, castling, ep_square)
+            else:
+                position = Board.from_string(board, turn)
         else:
-            return False
-        return True
-
-    def _validate_bishop_move(self, from_idx: int, to_idx: int) -> bool:
-        if self._is_same_color(from_idx, to_idx):
-            return False
-        from_row, from_col = (from_idx // 2) // 8, (from_idx // 2) % 8
-        to_row, to_col = (to_idx // 2) // 8, (to_idx // 2) % 8
-        if abs(from_row - to_row) == abs(from_col - to_col):
-            row_step = 16 if from_row < to_row else -16
-            col_step = 2 if from_col < to_col else -2
-            for step in range(1, abs(from_row - to_row)):
-                if self.board[
-                   from_idx + step * (row_step + col_step): from_idx + step * (row_step + col_step) + 2] != '00':
-                    return False
-            return True
-        return False
-
-    def _validate_knight_move(self, from_idx: int, to_idx: int) -> bool:
-        from_row, from_col = (from_idx // 2) // 8, (from_idx // 2) % 8
-        to_row, to_col = (to_idx // 2) // 8, (to_idx // 2) % 8
-        if (abs(from_row - to_row), abs(from_col - to_col)) in [(2, 1), (1, 2)]:
-            return not self._is_same_color(from_idx, to_idx)
-        return False
-
-    def _validate_pawn_move(self, color: str, from_idx: int, to_idx: int) -> bool:
-        from_row, from_col = (from_idx // 2) // 8, (from_idx // 2) % 8
-        to_row, to_col = (to_idx // 2) // 8, (to_idx // 2) % 8
-        if color == '1':
-            if from_row == 1 and to_row == from_row + 2 and from_col == to_col and self._is_empty(to_row - 1,
-                                                                                                  to_col):
-                return self._is_empty(to_row, to_col)
-            if to_row == from_row + 1 and from_col == to_col:
-                return self._is_empty(to_row, to_col)
-            if to_row == from_row + 1 and abs(to_col - from_col) == 1:
-                return not self._is_empty(to_row, to_col) and self._is_opponent(color, to_idx)
-        else:
-            if from_row == 6 and to_row == from_row - 2 and from_col == to_col and self._is_empty(to_row + 1,
-                                                                                                  to_col):
-                return self._is_empty(to_row, to_col)
-            if to_row == from_row - 1 and from_col == to_col:
-                return self._is_empty(to_row, to_col)
-            if to_row == from_row - 1 and abs(to_col - from_col) == 1:
-                return not self._is_empty(to_row, to_col) and self._is_opponent(color, to_idx)
-        return False
-
-    def _is_empty(self, row: int, col: int) -> bool:
-        return self.board[row * 16 + col * 2: row * 16 + col * 2 + 2] == '00'
-
-    def _is_opponent(self, color: str, idx: int) -> bool:
-        return (color == '1' and self.board[idx] == '2') or (color == '2' and self.board[idx] == '1')
-
-    def _is_same_color(self, from_idx: int, to_idx: int) -> bool:
-        return self.board[from_idx] == self.board[to_idx]
+            position = Board.from_string(INITIAL_BOARD)
+        start = snapshot.ply if snapshot else 0
+        moves = await MatchMove.filter(match_id=self.pk, ply__gt=start, ply__lte=ply).order_by('ply').values_list(
+            'move', flat=True)
+        for move in moves:
+            position.make_move(move)
+        return position
+
+
+class RatingHistory(Model):
+    user = fields.ForeignKeyField('models.User', related_name='rating_history')
+    system = fields.CharField(max_length=7)  # 'elo' or 'glicko2'
+    rating = fields.FloatField()
+    deviation = fields.FloatField(null=True)  # Glicko-2 only
+    match = fields.ForeignKeyField('models.Match', null=True)  # the game of an Elo update
+    created_at = fields.DatetimeField(auto_now_add=True)
+
+
+class MatchMove(Model):
+    match = fields.ForeignKeyField('models.Match', related_name='moves')
+    ply = fields.IntField()
+    move = fields.SmallIntField()  # 6 bits from square, 6 bits to square, 4 bits promotion piece
+    snapshot = fields.TextField(null=True)  # 'board|castling|en passant' every MOVE_SNAPSHOT_INTERVAL plies
+
+    class Meta:
+        unique_together = (('match', 'ply'),)
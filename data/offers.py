@@ -0,0 +1,80 @@
+import time
+
+from aioredis import Redis
+
+from config import OFFER_TTL_SECONDS, MAX_OFFERS
+
+# Offers a user received are a sorted set 'offers:<pk>' of inviter pks scored by expiry time in milliseconds
+ADDED = 1
+ALREADY_SENT = -1
+ALREADY_RECEIVED = -2
+TOO_MANY = -3
+
+# KEYS: receiver offers, inviter offers; ARGV: inviter pk, receiver pk, now, expires, cap
+ADD_SCRIPT = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[3])
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', ARGV[3])
+if redis.call('ZSCORE', KEYS[1], ARGV[1]) then
+    return -1
+end
+if redis.call('ZSCORE', KEYS[2], ARGV[2]) then
+    return -2
+end
+if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[5]) then
+    return -3
+end
+redis.call('ZADD', KEYS[1], ARGV[4], ARGV[1])
+redis.call('PEXPIREAT', KEYS[1], ARGV[4])
+return 1
+"""
+# KEYS: receiver offers; ARGV: inviter pk, now. Removes the offer, 1 when it existed and had not expired
+TAKE_SCRIPT = """
+local expires = redis.call('ZSCORE', KEYS[1], ARGV[1])
+if not expires then
+    return 0
+end
+redis.call('ZREM', KEYS[1], ARGV[1])
+if tonumber(expires) > tonumber(ARGV[2]) then
+    return 1
+end
+return 0
+"""
+
+
+def offers_key(user_pk: int) -> str:
+    return f'offers:{user_pk}'
+
+
+def _now() -> int:
+    return int(time.time() * 1000)
+
+
+class OfferStore:
+    def __init__(self):
+        self.redis: Redis | None = None
+        self._add = None
+        self._take = None
+
+    def start(self, redis: Redis):
+        self.redis = redis
+        self._add = redis.register_script(ADD_SCRIPT)
+        self._take = redis.register_script(TAKE_SCRIPT)
+
+    async def get(self, receiver_pk: int) -> list[int]:
+        offers = await self.redis.zrangebyscore(offers_key(receiver_pk), _now(), '+inf')
+        return list(map(int, offers))
+
+    async def add(self, receiver_pk: int, inviter_pk: int) -> int:
+        # Returns ADDED or the reason the offer was refused
+        now = _now()
+        return await self._add(
+            keys=[offers_key(receiver_pk), offers_key(inviter_pk)],
+            args=[inviter_pk, receiver_pk, now, now + OFFER_TTL_SECONDS * 1000, MAX_OFFERS],
+        )
+
+    async def take(self, receiver_pk: int, inviter_pk: int) -> bool:
+        # Accepting and rejecting both consume the offer, only one of concurrent calls gets True
+        return bool(await self._take(keys=[offers_key(receiver_pk)], args=[inviter_pk, _now()]))
+
+
+offers = OfferStore()
@@ -0,0 +1,5 @@
+from .board import (
+    Board, Undo, EMPTY, WHITE, BLACK, KING, QUEEN, ROOK, BISHOP, KNIGHT, PAWN, INITIAL_BOARD,
+    opponent, square, square_name, encode_move, decode_move, iter_bits,
+)
+from .cache import LRUCache, ONGOING, CHECK, CHECKMATE, STALEMATE, legal_moves, find_legal_move, game_status
@@ -0,0 +1,91 @@
+from typing import Sequence
+
+import numpy as np
+
+from .board import EMPTY, WHITE, BLACK, KING, QUEEN, ROOK, BISHOP, KNIGHT, PAWN
+from .tables import KNIGHT_ATTACKS, KING_ATTACKS, PAWN_ATTACKS, DIRECTIONS, ROOK_DIRECTIONS, BISHOP_DIRECTIONS
+
+# Boards are (N, 64) int8 arrays of piece codes (color << 3 | piece, 0 for empty), the same values as Board.squares
+
+
+def _matrix(table) -> np.ndarray:
+    # matrix[from_sq, to_sq] is 1 when the piece on from_sq attacks to_sq
+    return np.array([[bitboard >> sq & 1 for sq in range(64)] for bitboard in table], dtype=np.uint8)
+
+
+def _previous_squares(row_step: int, col_step: int) -> np.ndarray:
+    # The square one step back along the direction, 64 points at an always-empty padding column
+    result = np.full(64, 64, dtype=np.intp)
+    for sq in range(64):
+        row, col = sq // 8 - row_step, sq % 8 - col_step
+        if 0 <= row < 8 and 0 <= col < 8:
+            result[sq] = row * 8 + col
+    return result
+
+
+KNIGHT_MATRIX = _matrix(KNIGHT_ATTACKS)
+KING_MATRIX = _matrix(KING_ATTACKS)
+PAWN_MATRIX = (None, _matrix(PAWN_ATTACKS[WHITE]), _matrix(PAWN_ATTACKS[BLACK]))
+# Gathering with PREVIOUS[d] moves every square's value one step along direction d
+PREVIOUS = tuple(_previous_squares(row_step, col_step) for row_step, col_step in DIRECTIONS)
+
+
+def decode_boards(boards: Sequence[str]) -> np.ndarray:
+    codes = np.zeros((len(boards), 64), dtype=np.int8)
+    for i, board in enumerate(boards):
+        cells = np.frombuffer(board.replace('-', '').encode(), dtype=np.uint8).reshape(-1, 4) - 48
+        squares = (cells[:, 0].astype(np.intp) - 1) * 8 + cells[:, 1] - 1
+        codes[i, squares] = cells[:, 2] << 3 | cells[:, 3]
+    return codes
+
+
+def occupancy(codes: np.ndarray) -> np.ndarray:
+    # (N, 3, 64) bool indexed by color like Board.occupied, index 0 holds both colors
+    colors = codes >> 3
+    white, black = colors == WHITE, colors == BLACK
+    return np.stack((white | black, white, black), axis=1)
+
+
+def _leaper_attacks(pieces: np.ndarray, matrix: np.ndarray) -> np.ndarray:
+    return (pieces.astype(np.uint8) @ matrix) > 0
+
+
+def _slider_attacks(sliders: np.ndarray, occupied: np.ndarray, directions) -> np.ndarray:
+    attacks = np.zeros_like(sliders)
+    padded = np.zeros((sliders.shape[0], 65), dtype=bool)
+    for direction in directions:
+        frontier = sliders
+        for _ in range(7):
+            padded[:, :64] = frontier
+            frontier = padded[:, PREVIOUS[direction]]
+            if not frontier.any():
+                break
+            attacks |= frontier
+            frontier = frontier & ~occupied
+    return attacks
+
+
+def attack_maps(codes: np.ndarray) -> np.ndarray:
+    # (N, 3, 64) bool: squares attacked by each color, index 0 is unused
+    occupied = codes != EMPTY
+    result = np.zeros((codes.shape[0], 3, 64), dtype=bool)
+    for color in (WHITE, BLACK):
+        pieces = {piece: codes == (color << 3 | piece) for piece in (KING, QUEEN, ROOK, BISHOP, KNIGHT, PAWN)}
+        result[:, color] = (
+            _leaper_attacks(pieces[KNIGHT], KNIGHT_MATRIX)
+            | _leaper_attacks(pieces[KING], KING_MATRIX)
+            | _leaper_attacks(pieces[PAWN], PAWN_MATRIX[color])
+            | _slider_attacks(pieces[ROOK] | pieces[QUEEN], occupied, ROOK_DIRECTIONS)
+            | _slider_attacks(pieces[BISHOP] | pieces[QUEEN], occupied, BISHOP_DIRECTIONS)
+        )
+    return result
+
+
+def in_check(codes: np.ndarray, turns: np.ndarray, attacks: np.ndarray = None) -> np.ndarray:
+    # (N,) bool: the side to move (1-white 2-black per board) is in check
+    if attacks is None:
+        attacks = attack_maps(codes)
+    turns = np.asarray(turns)
+    kings = codes == (turns[:, None] << 3 | KING)
+    enemy_attacks = attacks[np.arange(codes.shape[0]), 3 - turns]
+    return (kings & enemy_attacks).any(axis=1)
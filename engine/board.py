@@ -0,0 +1,383 @@
+from typing import NamedTuple
+
+from .zobrist import PIECE_KEYS, CASTLING_KEYS, EP_KEYS, SIDE_KEY
+from .tables import KNIGHT_ATTACKS, KING_ATTACKS, PAWN_ATTACKS, rook_attacks, bishop_attacks, queen_attacks
+
+EMPTY = 0
+WHITE, BLACK = 1, 2
+KING, QUEEN, ROOK, BISHOP, KNIGHT, PAWN = 1, 2, 3, 4, 5, 6
+
+FILES = 'ABCDEFGH'
+INITIAL_BOARD = ("1113121513141412151116141715181321162216231624162516261627162816"
+                 "-8123822583248422852186248725882371267226732674267526762677267826")
+PROMOTIONS = (QUEEN, ROOK, BISHOP, KNIGHT)
+
+# Castling rights bits
+WHITE_KINGSIDE, WHITE_QUEENSIDE, BLACK_KINGSIDE, BLACK_QUEENSIDE = 1, 2, 4, 8
+# Rights kept when a piece moves from or to the square
+CASTLING_MASK = [15] * 64
+CASTLING_MASK[4] = 15 ^ (WHITE_KINGSIDE | WHITE_QUEENSIDE)
+CASTLING_MASK[7] = 15 ^ WHITE_KINGSIDE
+CASTLING_MASK[0] = 15 ^ WHITE_QUEENSIDE
+CASTLING_MASK[60] = 15 ^ (BLACK_KINGSIDE | BLACK_QUEENSIDE)
+CASTLING_MASK[63] = 15 ^ BLACK_KINGSIDE
+CASTLING_MASK[56] = 15 ^ BLACK_QUEENSIDE
+
+
+def opponent(color: int) -> int:
+    return BLACK if color == WHITE else WHITE
+
+
+def square(notation: str) -> int:
+    file = FILES.index(notation[0].upper())
+    rank = int(notation[1]) - 1
+    if not 0 <= rank < 8:
+        raise ValueError(f'Invalid square: {notation}')
+    return rank * 8 + file
+
+
+def square_name(sq: int) -> str:
+    return FILES[sq % 8] + str(sq // 8 + 1)
+
+
+def encode_move(from_sq: int, to_sq: int, promotion: int = 0) -> int:
+    # 16 bits: 6 bits source, 6 bits target, 4 bits promotion piece
+    return from_sq | to_sq << 6 | promotion << 12
+
+
+def decode_move(move: int) -> tuple[int, int, int]:
+    return move & 63, move >> 6 & 63, move >> 12
+
+
+def _castling_rook(king_from: int, king_to: int) -> tuple[int, int]:
+    return (king_from + 3, king_from + 1) if king_to > king_from else (king_from - 4, king_from - 1)
+
+
+def iter_bits(bitboard: int):
+    while bitboard:
+        low = bitboard & -bitboard
+        yield low.bit_length() - 1
+        bitboard ^= low
+
+
+class Undo(NamedTuple):
+    move: int
+    piece: int
+    captured: int
+    captured_sq: int
+    castling: int
+    ep_square: int
+    white_attacks: int
+    black_attacks: int
+    hash: int
+
+
+class Board:
+    # squares[sq] = color << 3 | piece, 0 for an empty square
+    # pieces[color][piece] and occupied[color] are 64-bit bitboards, occupied[0] holds both colors
+    # ep_square is the square a pawn skipped over on the last double push if it can be captured, otherwise -1
+    # kings[color] tracks the king square, attacks[color] caches the attack map (-1 until rebuilt after a change)
+    # hash is the Zobrist key of the position including the side to move
+    __slots__ = ('squares', 'pieces', 'occupied', 'castling', 'ep_square', 'kings', 'attacks', 'turn', 'hash')
+
+    def __init__(self):
+        self.squares = bytearray(64)
+        self.pieces = [[0] * 7 for _ in range(3)]
+        self.occupied = [0, 0, 0]
+        self.castling = 0
+        self.ep_square = -1
+        self.kings = [-1, -1, -1]
+        self.attacks = [0, -1, -1]
+        self.turn = WHITE
+        self.hash = 0
+
+    @classmethod
+    def from_string(cls, board: str, turn: int = WHITE, castling: int = None, ep_square: int = -1) -> 'Board':
+        # Stored format: 4 digits per piece - rank, file, color, piece (1413 -> 1D white rook),
+        # white and black pieces separated by '-'. The format keeps no castling rights or en passant square,
+        # pass them when they are known
+        position = cls()
+        cells = board.replace('-', '')
+        if len(cells) % 4 or not cells.isdigit():
+            raise ValueError('Malformed board string')
+        for i in range(0, len(cells), 4):
+            rank, file, color, piece = (ord(c) - 48 for c in cells[i:i + 4])
+            if not (1 <= rank <= 8 and 1 <= file <= 8 and color in (WHITE, BLACK) and KING <= piece <= PAWN):
+                raise ValueError(f'Malformed board cell: {cells[i:i + 4]}')
+            sq = (rank - 1) * 8 + file - 1
+            if position.squares[sq]:
+                raise ValueError(f'Two pieces on {square_name(sq)}')
+            position.put(sq, color, piece)
+        if castling is not None:
+            position.castling = castling
+        else:
+            # Unknown rights are guessed: a king and rook on their home squares may castle
+            for right, king, rook in ((WHITE_KINGSIDE, 4, 7), (WHITE_QUEENSIDE, 4, 0),
+                                      (BLACK_KINGSIDE, 60, 63), (BLACK_QUEENSIDE, 60, 56)):
+                color = WHITE if king == 4 else BLACK
+                if position.squares[king] == color << 3 | KING and position.squares[rook] == color << 3 | ROOK:
+                    position.castling |= right
+        position.hash ^= CASTLING_KEYS[position.castling]
+        if ep_square >= 0:
+            position.ep_square = ep_square
+            position.hash ^= EP_KEYS[ep_square & 7]
+        if turn == BLACK:
+            position.turn = BLACK
+            position.hash ^= SIDE_KEY
+        return position
+
+    @classmethod
+    def from_fen(cls, fen: str) -> 'Board':
+        placement, turn, castling, ep_square = fen.split()[:4]
+        pieces = {'k': KING, 'q': QUEEN, 'r': ROOK, 'b': BISHOP, 'n': KNIGHT, 'p': PAWN}
+        position = cls()
+        for row, rank in enumerate(placement.split('/')):
+            sq = (7 - row) * 8
+            for char in rank:
+                if char.isdigit():
+                    sq += int(char)
+                else:
+                    position.put(sq, WHITE if char.isupper() else BLACK, pieces[char.lower()])
+                    sq += 1
+        for right, char in ((WHITE_KINGSIDE, 'K'), (WHITE_QUEENSIDE, 'Q'), (BLACK_KINGSIDE, 'k'), (BLACK_QUEENSIDE, 'q')):
+            if char in castling:
+                position.castling |= right
+        position.hash ^= CASTLING_KEYS[position.castling]
+        if turn == 'b':
+            position.turn = BLACK
+            position.hash ^= SIDE_KEY
+        if ep_square != '-':
+            position.ep_square = square(ep_square)
+            position.hash ^= EP_KEYS[position.ep_square & 7]
+        return position
+
+    def to_string(self) -> str:
+        white, black = [], []
+        for sq in iter_bits(self.occupied[WHITE]):
+            white.append(self._cell(sq))
+        for rank in range(7, -1, -1):
+            for sq in iter_bits(self.occupied[BLACK] & (0xFF << rank * 8)):
+                black.append(self._cell(sq))
+        return ''.join(white) + '-' + ''.join(black)
+
+    def _cell(self, sq: int) -> str:
+        code = self.squares[sq]
+        return f'{sq // 8 + 1}{sq % 8 + 1}{code >> 3}{code & 7}'
+
+    def copy(self) -> 'Board':
+        position = Board.__new__(Board)
+        position.squares = self.squares[:]
+        position.pieces = [row[:] for row in self.pieces]
+        position.occupied = self.occupied[:]
+        position.castling = self.castling
+        position.ep_square = self.ep_square
+        position.kings = self.kings[:]
+        position.attacks = self.attacks[:]
+        position.turn = self.turn
+        position.hash = self.hash
+        return position
+
+    def piece_at(self, sq: int) -> tuple[int, int]:
+        code = self.squares[sq]
+        return code >> 3, code & 7
+
+    def put(self, sq: int, color: int, piece: int):
+        bit = 1 << sq
+        self.squares[sq] = color << 3 | piece
+        self.pieces[color][piece] |= bit
+        self.occupied[color] |= bit
+        self.occupied[EMPTY] |= bit
+        if piece == KING:
+            self.kings[color] = sq
+        self.hash ^= PIECE_KEYS[color << 3 | piece][sq]
+        self.attacks[WHITE] = self.attacks[BLACK] = -1
+
+    def remove(self, sq: int) -> int:
+        code = self.squares[sq]
+        if code:
+            bit = ~(1 << sq)
+            color = code >> 3
+            self.squares[sq] = 0
+            self.pieces[color][code & 7] &= bit
+            self.occupied[color] &= bit
+            self.occupied[EMPTY] &= bit
+            if code & 7 == KING:
+                self.kings[color] = -1
+            self.hash ^= PIECE_KEYS[code][sq]
+            self.attacks[WHITE] = self.attacks[BLACK] = -1
+        return code
+
+    def make_move(self, move: int) -> 'Undo':
+        # Applies the move in place, the returned record restores the position with unmake_move
+        from_sq, to_sq, promotion = move & 63, move >> 6 & 63, move >> 12
+        undo = Undo(move, self.squares[from_sq], self.squares[to_sq], to_sq, self.castling, self.ep_square,
+                    self.attacks[WHITE], self.attacks[BLACK], self.hash)
+        code = self.remove(from_sq)
+        color, piece = code >> 3, code & 7
+        self.remove(to_sq)
+        if piece == PAWN:
+            if to_sq == self.ep_square:
+                captured_sq = to_sq - 8 if color == WHITE else to_sq + 8
+                undo = undo._replace(captured=self.remove(captured_sq), captured_sq=captured_sq)
+            if promotion:
+                piece = promotion
+        elif piece == KING and abs(to_sq - from_sq) == 2:
+            rook_from, rook_to = _castling_rook(from_sq, to_sq)
+            self.put(rook_to, color, self.remove(rook_from) & 7)
+        self.put(to_sq, color, piece)
+        self.hash ^= CASTLING_KEYS[self.castling]
+        self.castling &= CASTLING_MASK[from_sq] & CASTLING_MASK[to_sq]
+        self.hash ^= CASTLING_KEYS[self.castling] ^ SIDE_KEY
+        if self.ep_square >= 0:
+            self.hash ^= EP_KEYS[self.ep_square & 7]
+            self.ep_square = -1
+        if piece == PAWN and abs(to_sq - from_sq) == 16:
+            ep_square = (from_sq + to_sq) // 2
+            if PAWN_ATTACKS[color][ep_square] & self.pieces[opponent(color)][PAWN]:
+                self.ep_square = ep_square
+                self.hash ^= EP_KEYS[ep_square & 7]
+        self.turn = opponent(color)
+        return undo
+
+    def unmake_move(self, undo: 'Undo'):
+        from_sq, to_sq = undo.move & 63, undo.move >> 6 & 63
+        code = undo.piece
+        color = code >> 3
+        self.remove(to_sq)
+        self.put(from_sq, color, code & 7)
+        if undo.captured:
+            self.put(undo.captured_sq, undo.captured >> 3, undo.captured & 7)
+        if code & 7 == KING and abs(to_sq - from_sq) == 2:
+            rook_from, rook_to = _castling_rook(from_sq, to_sq)
+            self.put(rook_from, color, self.remove(rook_to) & 7)
+        self.castling = undo.castling
+        self.ep_square = undo.ep_square
+        self.attacks[WHITE] = undo.white_attacks
+        self.attacks[BLACK] = undo.black_attacks
+        self.turn = color
+        self.hash = undo.hash
+
+    def king_square(self, color: int) -> int:
+        return self.kings[color]
+
+    def attacks_from(self, sq: int) -> int:
+        code = self.squares[sq]
+        piece = code & 7
+        if piece == KNIGHT:
+            return KNIGHT_ATTACKS[sq]
+        if piece == KING:
+            return KING_ATTACKS[sq]
+        if piece == PAWN:
+            return PAWN_ATTACKS[code >> 3][sq]
+        if piece == ROOK:
+            return rook_attacks(sq, self.occupied[EMPTY])
+        if piece == BISHOP:
+            return bishop_attacks(sq, self.occupied[EMPTY])
+        if piece == QUEEN:
+            return queen_attacks(sq, self.occupied[EMPTY])
+        return 0
+
+    def attack_map(self, color: int) -> int:
+        attacks = self.attacks[color]
+        if attacks < 0:
+            attacks = 0
+            for sq in iter_bits(self.occupied[color]):
+                attacks |= self.attacks_from(sq)
+            self.attacks[color] = attacks
+        return attacks
+
+    def is_attacked(self, sq: int, by_color: int) -> bool:
+        attacks = self.attacks[by_color]
+        if attacks >= 0:
+            return bool(attacks >> sq & 1)
+        # Look from the square outwards: it is attacked by a piece it could attack itself as the same piece
+        pieces = self.pieces[by_color]
+        if (KNIGHT_ATTACKS[sq] & pieces[KNIGHT] or KING_ATTACKS[sq] & pieces[KING]
+                or PAWN_ATTACKS[opponent(by_color)][sq] & pieces[PAWN]):
+            return True
+        occupied = self.occupied[EMPTY]
+        return bool(rook_attacks(sq, occupied) & (pieces[ROOK] | pieces[QUEEN])
+                    or bishop_attacks(sq, occupied) & (pieces[BISHOP] | pieces[QUEEN]))
+
+    def in_check(self, color: int) -> bool:
+        king = self.kings[color]
+        return king >= 0 and self.is_attacked(king, opponent(color))
+
+    def moves_from(self, sq: int) -> list[int]:
+        code = self.squares[sq]
+        if not code:
+            return []
+        color, piece = code >> 3, code & 7
+        own, enemy, occupied = self.occupied[color], self.occupied[opponent(color)], self.occupied[EMPTY]
+        if piece != PAWN:
+            moves = [sq | to_sq << 6 for to_sq in iter_bits(self.attacks_from(sq) & ~own)]
+            if piece == KING and self.castling:
+                moves.extend(self._castling_moves(color, sq))
+            return moves
+
+        forward = 8 if color == WHITE else -8
+        targets = PAWN_ATTACKS[color][sq] & enemy
+        if self.ep_square >= 0 and PAWN_ATTACKS[color][sq] >> self.ep_square & 1:
+            targets |= 1 << self.ep_square
+        one = sq + forward
+        if not occupied >> one & 1:
+            targets |= 1 << one
+            two = one + forward
+            if sq // 8 == (1 if color == WHITE else 6) and not occupied >> two & 1:
+                targets |= 1 << two
+        moves = []
+        for to_sq in iter_bits(targets):
+            if to_sq < 8 or to_sq >= 56:
+                moves.extend(sq | to_sq << 6 | promotion << 12 for promotion in PROMOTIONS)
+            else:
+                moves.append(sq | to_sq << 6)
+        return moves
+
+    def _castling_moves(self, color: int, king: int) -> list[int]:
+        if color == WHITE:
+            sides = ((WHITE_KINGSIDE, 0x60, 6, (5, 6)), (WHITE_QUEENSIDE, 0x0E, 2, (3, 2)))
+        else:
+            sides = ((BLACK_KINGSIDE, 0x60 << 56, 62, (61, 62)), (BLACK_QUEENSIDE, 0x0E << 56, 58, (59, 58)))
+        moves = []
+        for right, between, target, passing in sides:
+            if self.castling & right and not self.occupied[EMPTY] & between:
+                attacks = self.attack_map(opponent(color))
+                if not any(attacks >> sq & 1 for sq in (king, *passing)):
+                    moves.append(king | target << 6)
+        return moves
+
+    def pseudo_legal_moves(self, color: int) -> list[int]:
+        moves = []
+        for sq in iter_bits(self.occupied[color]):
+            moves.extend(self.moves_from(sq))
+        return moves
+
+    def is_legal_move(self, move: int) -> bool:
+        color = self.squares[move & 63] >> 3
+        undo = self.make_move(move)
+        legal = not self.in_check(color)
+        self.unmake_move(undo)
+        return legal
+
+    def legal_moves(self, color: int) -> list[int]:
+        return [move for move in self.pseudo_legal_moves(color) if self.is_legal_move(move)]
+
+    def find_move(self, from_sq: int, to_sq: int, promotion: int = QUEEN) -> int:
+        # Returns the encoded legal move or -1
+        for move in self.moves_from(from_sq):
+            if move >> 6 & 63 == to_sq and move >> 12 in (0, promotion) and self.is_legal_move(move):
+                return move
+        return -1
+
+    def has_legal_moves(self, color: int) -> bool:
+        for sq in iter_bits(self.occupied[color]):
+            for move in self.moves_from(sq):
+                if self.is_legal_move(move):
+                    return True
+        return False
+
+    def is_checkmate(self, color: int) -> bool:
+        return self.in_check(color) and not self.has_legal_moves(color)
+
+    def is_stalemate(self, color: int) -> bool:
+        return not self.in_check(color) and not self.has_legal_moves(color)
@@ -0,0 +1,68 @@
+from collections import OrderedDict
+
+from .board import Board
+
+ONGOING, CHECK, CHECKMATE, STALEMATE = 0, 1, 2, 3
+
+
+class LRUCache:
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        self._data.clear()
+        self.hits = self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+
+# Keyed by Board.hash, which already includes castling rights, en passant file and the side to move
+legal_moves_cache = LRUCache(65536)
+status_cache = LRUCache(65536)
+
+
+def legal_moves(position: Board) -> tuple[int, ...]:
+    moves = legal_moves_cache.get(position.hash)
+    if moves is None:
+        moves = tuple(position.legal_moves(position.turn))
+        legal_moves_cache.put(position.hash, moves)
+    return moves
+
+
+def find_legal_move(position: Board, from_sq: int, to_sq: int, promotion: int) -> int:
+    for move in legal_moves(position):
+        if move & 4095 == from_sq | to_sq << 6 and move >> 12 in (0, promotion):
+            return move
+    return -1
+
+
+def game_status(position: Board) -> int:
+    status = status_cache.get(position.hash)
+    if status is None:
+        in_check = position.in_check(position.turn)
+        if legal_moves(position):
+            status = CHECK if in_check else ONGOING
+        else:
+            status = CHECKMATE if in_check else STALEMATE
+        status_cache.put(position.hash, status)
+    return status
@@ -0,0 +1,69 @@
+import argparse
+import sys
+import time
+
+from .board import Board, INITIAL_BOARD, square_name
+
+# Known leaf counts from depth 1, see https://www.chessprogramming.org/Perft_Results
+POSITIONS = {
+    'initial': (INITIAL_BOARD, (20, 400, 8902, 197281, 4865609)),
+    'kiwipete': ('r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+                 (48, 2039, 97862, 4085603)),
+    'position3': ('8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1', (14, 191, 2812, 43238, 674624)),
+    'position4': ('r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1', (6, 264, 9467, 422333)),
+    'position5': ('rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8', (44, 1486, 62379, 2103487)),
+}
+
+
+def load_position(board: str) -> Board:
+    return Board.from_fen(board) if '/' in board else Board.from_string(board)
+
+
+def perft(position: Board, depth: int) -> int:
+    if depth == 0:
+        return 1
+    nodes = 0
+    color = position.turn
+    for move in position.pseudo_legal_moves(color):
+        undo = position.make_move(move)
+        if not position.in_check(color):
+            nodes += 1 if depth == 1 else perft(position, depth - 1)
+        position.unmake_move(undo)
+    return nodes
+
+
+def divide(position: Board, depth: int) -> dict[str, int]:
+    result = {}
+    for move in position.legal_moves(position.turn):
+        undo = position.make_move(move)
+        name = square_name(move & 63) + square_name(move >> 6 & 63) + ('', '', 'q', 'r', 'b', 'n')[move >> 12]
+        result[name.lower()] = perft(position, depth - 1)
+        position.unmake_move(undo)
+    return result
+
+
+def run(names, depth: int) -> bool:
+    passed = True
+    for name in names:
+        board, expected = POSITIONS[name]
+        position = load_position(board)
+        for level in range(1, min(depth, len(expected)) + 1):
+            started = time.perf_counter()
+            nodes = perft(position, level)
+            elapsed = time.perf_counter() - started
+            ok = nodes == expected[level - 1]
+            passed &= ok
+            print(f'{name:<10} depth {level}: {nodes:>9} nodes {elapsed:8.3f}s '
+                  f'{nodes / elapsed if elapsed else 0:>10.0f} nps {"ok" if ok else f"FAIL expected {expected[level - 1]}"}')
+    return passed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Count move generator leaf nodes against known perft results')
+    parser.add_argument('-d', '--depth', type=int, default=3)
+    parser.add_argument('positions', nargs='*', metavar='position', help=', '.join(POSITIONS))
+    args = parser.parse_args()
+    unknown = set(args.positions) - set(POSITIONS)
+    if unknown:
+        parser.error(f'unknown positions: {", ".join(sorted(unknown))}')
+    sys.exit(0 if run(args.positions or POSITIONS, args.depth) else 1)
@@ -0,0 +1,58 @@
+# Attack tables are built once at import, every entry is a 64-bit bitboard indexed by square (rank * 8 + file)
+
+def _bit(row: int, col: int) -> int:
+    return 1 << (row * 8 + col) if 0 <= row < 8 and 0 <= col < 8 else 0
+
+
+def _leaper(offsets) -> tuple[int, ...]:
+    return tuple(
+        sum(_bit(sq // 8 + row_step, sq % 8 + col_step) for row_step, col_step in offsets) for sq in range(64)
+    )
+
+
+def _ray(sq: int, row_step: int, col_step: int) -> int:
+    ray, row, col = 0, sq // 8 + row_step, sq % 8 + col_step
+    while 0 <= row < 8 and 0 <= col < 8:
+        ray |= 1 << (row * 8 + col)
+        row, col = row + row_step, col + col_step
+    return ray
+
+
+KNIGHT_ATTACKS = _leaper(((1, 2), (2, 1), (2, -1), (1, -2), (-1, -2), (-2, -1), (-2, 1), (-1, 2)))
+KING_ATTACKS = _leaper(((1, 1), (1, 0), (1, -1), (0, 1), (0, -1), (-1, 1), (-1, 0), (-1, -1)))
+# Indexed by color: 1-white pawns capture upwards, 2-black pawns capture downwards
+PAWN_ATTACKS = (None, _leaper(((1, -1), (1, 1))), _leaper(((-1, -1), (-1, 1))))
+
+# Directions 0-3 step to higher squares, 4-7 to lower ones
+DIRECTIONS = ((1, 0), (0, 1), (1, 1), (1, -1), (-1, 0), (0, -1), (-1, -1), (-1, 1))
+ROOK_DIRECTIONS = (0, 1, 4, 5)
+BISHOP_DIRECTIONS = (2, 3, 6, 7)
+QUEEN_DIRECTIONS = ROOK_DIRECTIONS + BISHOP_DIRECTIONS
+RAYS = tuple(tuple(_ray(sq, row_step, col_step) for sq in range(64)) for row_step, col_step in DIRECTIONS)
+
+
+def slider_attacks(sq: int, occupied: int, directions) -> int:
+    attacks = 0
+    for direction in directions:
+        ray = RAYS[direction][sq]
+        blockers = ray & occupied
+        if blockers:
+            if direction < 4:
+                blocker = (blockers & -blockers).bit_length() - 1
+            else:
+                blocker = blockers.bit_length() - 1
+            ray ^= RAYS[direction][blocker]
+        attacks |= ray
+    return attacks
+
+
+def rook_attacks(sq: int, occupied: int) -> int:
+    return slider_attacks(sq, occupied, ROOK_DIRECTIONS)
+
+
+def bishop_attacks(sq: int, occupied: int) -> int:
+    return slider_attacks(sq, occupied, BISHOP_DIRECTIONS)
+
+
+def queen_attacks(sq: int, occupied: int) -> int:
+    return slider_attacks(sq, occupied, QUEEN_DIRECTIONS)
@@ -0,0 +1,16 @@
+from random import Random
+
+# Fixed seed keeps hashes stable across processes so they can be stored next to Match.board.
+# Keys are 63-bit to fit a signed BIGINT column.
+_random = Random(0x5EED)
+
+
+def _key() -> int:
+    return _random.getrandbits(63)
+
+
+# Indexed by piece code (color << 3 | piece) and square
+PIECE_KEYS = tuple(tuple(_key() for _ in range(64)) if code & 7 else (0,) * 64 for code in range(23))
+CASTLING_KEYS = (0,) + tuple(_key() for _ in range(15))
+EP_KEYS = tuple(_key() for _ in range(8))
+SIDE_KEY = _key()
@@ -3,8 +3,16 @@ from fastapi import FastAPI
 from starlette.staticfiles import StaticFiles
 from tortoise.contrib.fastapi import register_tortoise
 from config import REDIS_URL
+from data.database import TORTOISE_ORM
 from data.models import User
-from resources.auth import get_password_hash
+from data.offers import offers
+from resources.auth import get_password_hash_async
+from resources.leaderboards import leaderboards
+from resources.live_matches import live_matches
+from resources.matchmaking import matchmaking
+from resources.tournaments import tournaments
+from resources.user_cache import user_cache
+from resources.ws_bus import bus
 from urls import urls
 import routers
 
@@ -15,16 +23,29 @@ for router in urls:
     app.include_router(router)
 
 
+# Handlers run in registration order: live matches are flushed before the database closes
+# and the database is ready before the startup handler runs
+@app.on_event("shutdown")
+async def shutdown():
+    matchmaking.stop()
+    await live_matches.stop()
+    await bus.stop()
+
+
+register_tortoise(app, config=TORTOISE_ORM, generate_schemas=True)
+
+
 @app.on_event("startup")
 async def startup():
     redis = await from_url(REDIS_URL)
     app.redis = redis
-    register_tortoise(
-        app,
-        db_url="sqlite://db.sqlite3",
-        modules={"models": ["data.models"]},
-        generate_schemas=True,
-    )
+    await bus.start(redis)
+    await user_cache.start()
+    offers.start(redis)
+    live_matches.start()
+    matchmaking.start(redis)
+    await tournaments.start()
+    leaderboards.start(redis)
 
 
 @app.get('/init')
@@ -35,7 +56,7 @@ async def init_project():
     # Create Super Admin
     r = await User.create(
         username="admin",
-        password=get_password_hash('1234qwer'),
+        password=await get_password_hash_async('1234qwer'),
         fullname='Abdulloh Umar',
         age=17,
         country='Uzbekistan',
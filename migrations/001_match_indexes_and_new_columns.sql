@@ -0,0 +1,20 @@
+-- Brings a database created before these columns and indexes existed up to date, works on SQLite and Postgres:
+--   sqlite3 db.sqlite3 < migrations/001_match_indexes_and_new_columns.sql
+--   psql "$DATABASE_URL" -f migrations/001_match_indexes_and_new_columns.sql
+-- New tables (matchmove, ratinghistory) are created by generate_schemas on startup.
+-- Skip the ALTER TABLE lines of columns the database already has.
+
+ALTER TABLE "match" ADD COLUMN "position_hash" BIGINT NOT NULL DEFAULT 0;
+ALTER TABLE "match" ADD COLUMN "plies" INT NOT NULL DEFAULT 0;
+ALTER TABLE "match" ADD COLUMN "increment" BIGINT NOT NULL DEFAULT 0;
+ALTER TABLE "tournament" ADD COLUMN "round" INT NOT NULL DEFAULT 0;
+ALTER TABLE "tournamentparticipant" ADD COLUMN "had_bye" BOOL NOT NULL DEFAULT FALSE;
+ALTER TABLE "user" ADD COLUMN "rating" DOUBLE PRECISION NOT NULL DEFAULT 1500;
+ALTER TABLE "user" ADD COLUMN "glicko_rating" DOUBLE PRECISION NOT NULL DEFAULT 1500;
+ALTER TABLE "user" ADD COLUMN "glicko_deviation" DOUBLE PRECISION NOT NULL DEFAULT 350;
+ALTER TABLE "user" ADD COLUMN "glicko_volatility" DOUBLE PRECISION NOT NULL DEFAULT 0.06;
+
+CREATE INDEX IF NOT EXISTS "idx_match_white_player_id" ON "match" ("white_player_id");
+CREATE INDEX IF NOT EXISTS "idx_match_black_player_id" ON "match" ("black_player_id");
+CREATE INDEX IF NOT EXISTS "idx_match_winner" ON "match" ("winner");
+CREATE INDEX IF NOT EXISTS "idx_match_tournament_id" ON "match" ("tournament_id");
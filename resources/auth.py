@@ -1,12 +1,26 @@
+import asyncio
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from datetime import datetime, timedelta
 
 import jwt
+from jwt import InvalidTokenError
 from passlib.context import CryptContext
 
 from config import *
 from data.schemas import TokenModel
+from resources.api_response import APIException
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Verified token -> (username, expiry timestamp), most recently used last
+_token_claims: OrderedDict[str, tuple[str, float]] = OrderedDict()
+
+# bcrypt runs off the event loop so hashing never blocks live games
+_password_pool = (ProcessPoolExecutor if PASSWORD_HASH_EXECUTOR == 'process' else ThreadPoolExecutor)(
+    max_workers=PASSWORD_HASH_WORKERS)
+password_pool_stats = {'running': 0, 'queued': 0, 'max_queued': 0, 'completed': 0, 'rejected': 0}
+_password_slots: asyncio.Semaphore | None = None
 
 
 def verify_password(plain_password: str, hashed_password: str):
@@ -17,9 +31,62 @@ def get_password_hash(password: str):
     return pwd_context.hash(password)
 
 
+async def _run_in_password_pool(func, *args):
+    global _password_slots
+    if _password_slots is None:
+        _password_slots = asyncio.Semaphore(PASSWORD_HASH_WORKERS)
+    stats = password_pool_stats
+    if stats['queued'] >= PASSWORD_HASH_MAX_QUEUE:
+        stats['rejected'] += 1
+        raise APIException(503, 'Server is busy, try again later')
+    stats['queued'] += 1
+    stats['max_queued'] = max(stats['max_queued'], stats['queued'])
+    try:
+        await _password_slots.acquire()
+    finally:
+        stats['queued'] -= 1
+    stats['running'] += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_password_pool, func, *args)
+    finally:
+        stats['running'] -= 1
+        stats['completed'] += 1
+        _password_slots.release()
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await _run_in_password_pool(verify_password, plain_password, hashed_password)
+
+
+async def get_password_hash_async(password: str) -> str:
+    return await _run_in_password_pool(get_password_hash, password)
+
+
 def create_access_token(username: str):
     to_encode = {'sub': username}
     expire = datetime.now() + timedelta(days=ACCESS_TOKEN_EXPIRE_DAYS)
     to_encode.update({"exp": expire})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return TokenModel(access_token=encoded_jwt, token_type="Bearer")
+
+
+def decode_access_token(token: str) -> tuple[str, float] | None:
+    # Returns (username, expiry) of a valid token, the signature is verified once while the token stays cached
+    claims = _token_claims.get(token)
+    if claims is not None:
+        if claims[1] > time.time():
+            _token_claims.move_to_end(token)
+            return claims
+        del _token_claims[token]
+        return None
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except InvalidTokenError:
+        return None
+    username = payload.get("sub")
+    if username is None:
+        return None
+    claims = _token_claims[token] = (username, payload['exp'])
+    if len(_token_claims) > TOKEN_CACHE_SIZE:
+        _token_claims.popitem(last=False)
+    return claims
@@ -0,0 +1,83 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from datetime import timedelta
+
+from config import CLOCK_RESOLUTION_SECONDS
+from data.models import Match
+
+
+class GameClocks:
+    # Flag-fall deadlines of all games share one heap checked every tick. A move pushes a new deadline and bumps
+    # the game's generation, older entries of the game are skipped when they come up. The heap is rebuilt from the
+    # running turns once skipped entries outnumber them twice
+    def __init__(self, resolution: float = CLOCK_RESOLUTION_SECONDS):
+        self.resolution = resolution
+        self._heap: list[tuple[float, int, int]] = []
+        self._turns: dict[int, tuple[float, int, float]] = {}  # match_id -> (turn started at, generation, deadline)
+        self._generations = itertools.count()
+        self._on_flag = None
+        self._task: asyncio.Task | None = None
+        self._flagging: set[asyncio.Task] = set()
+
+    def start(self, on_flag):
+        # on_flag(match_id) runs once the side to move of a tracked game has run out of time
+        self._on_flag = on_flag
+        if self._task is None:
+            self._task = asyncio.create_task(self._tick_loop())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def track(self, match: Match):
+        # Starts the clock of the side to move
+        now = time.monotonic()
+        generation = next(self._generations)
+        deadline = now + match.remaining(match.now_turn).total_seconds()
+        self._turns[match.pk] = (now, generation, deadline)
+        heapq.heappush(self._heap, (deadline, match.pk, generation))
+        if len(self._heap) - len(self._turns) > 2 * len(self._turns):
+            self._heap = [(deadline, match_id, generation)
+                          for match_id, (_, generation, deadline) in self._turns.items()]
+            heapq.heapify(self._heap)
+
+    def untrack(self, match_id: int):
+        self._turns.pop(match_id, None)
+
+    def elapsed(self, match: Match) -> timedelta | None:
+        turn = self._turns.get(match.pk)
+        return None if turn is None else timedelta(seconds=time.monotonic() - turn[0])
+
+    def expired(self) -> list[int]:
+        now = time.monotonic()
+        expired = []
+        while self._heap and self._heap[0][0] <= now:
+            _, match_id, generation = heapq.heappop(self._heap)
+            turn = self._turns.get(match_id)
+            if turn is not None and turn[1] == generation:
+                del self._turns[match_id]
+                expired.append(match_id)
+        return expired
+
+    async def _flag(self, match_id: int):
+        try:
+            await self._on_flag(match_id)
+        except Exception:
+            logging.exception('Clock flag of match %s failed', match_id)
+
+    async def _tick_loop(self):
+        while True:
+            await asyncio.sleep(self.resolution)
+            # Finishing a game waits for its result commit, flags run as tasks so the tick is never held up
+            # and flags falling together are committed in one batch
+            for match_id in self.expired():
+                task = asyncio.create_task(self._flag(match_id))
+                self._flagging.add(task)
+                task.add_done_callback(self._flagging.discard)
+
+
+clocks = GameClocks()
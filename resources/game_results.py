@@ -0,0 +1,93 @@
+import asyncio
+import logging
+from collections import defaultdict
+
+from tortoise.expressions import F
+from tortoise.transactions import in_transaction
+
+from config import GAME_RESULT_BATCH_SECONDS, GAME_RESULT_BATCH_SIZE
+from data.models import Match, MatchMove, User
+from engine import WHITE, BLACK
+from resources.user_cache import user_cache
+
+# Fields written when a game ends, the rest of the row does not change after creation
+RESULT_FIELDS = ('board', 'now_turn', 'position_hash', 'plies', 'during_1', 'during_2', 'winner', 'finished_at')
+
+
+class GameResults:
+    # Finished games are queued and committed in batches: the match rows, their remaining moves and the players'
+    # counters go in one transaction, counters are incremented with F() expressions
+    def __init__(self, delay: float = GAME_RESULT_BATCH_SECONDS, batch_size: int = GAME_RESULT_BATCH_SIZE):
+        self.delay = delay
+        self.batch_size = batch_size
+        self._pending: list[tuple[Match, asyncio.Future]] = []
+        self._task: asyncio.Task | None = None
+
+    async def commit(self, match: Match):
+        # Returns once the result is stored, raises when its batch failed
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((match, future))
+        if self._task is None:
+            self._task = asyncio.create_task(self._commit_pending())
+        await future
+
+    async def _commit_pending(self):
+        await asyncio.sleep(self.delay)
+        while self._pending:
+            batch, self._pending = self._pending[:self.batch_size], self._pending[self.batch_size:]
+            try:
+                await self._commit([match for match, _ in batch])
+            except Exception:
+                # One bad game must not lose the others, retry them one by one
+                logging.exception('Committing %d game results failed, retrying them one by one', len(batch))
+                for match, future in batch:
+                    try:
+                        await self._commit([match])
+                    except Exception as e:
+                        future.set_exception(e)
+                    else:
+                        future.set_result(None)
+            else:
+                for _, future in batch:
+                    future.set_result(None)
+        self._task = None
+
+    @staticmethod
+    async def _commit(matches: list[Match]):
+        # Players with the same counter changes share one UPDATE
+        counters = defaultdict(lambda: [0, 0, 0])  # user id -> [games, wins, losses]
+        for match in matches:
+            for user_id, color in ((match.white_player_id, WHITE), (match.black_player_id, BLACK)):
+                counter = counters[user_id]
+                counter[0] += 1
+                if match.winner == color:
+                    counter[1] += 1
+                elif match.winner != 0:
+                    counter[2] += 1
+        groups = defaultdict(list)
+        for user_id, counter in counters.items():
+            groups[tuple(counter)].append(user_id)
+        # Taken before the first await, so nothing else writes the same moves
+        moves = [match.take_pending_moves() for match in matches]
+        try:
+            async with in_transaction() as connection:
+                await Match.bulk_update(matches, fields=RESULT_FIELDS, using_db=connection)
+                new_moves = [move for match_moves in moves for move in match_moves]
+                if new_moves:
+                    await MatchMove.bulk_create(new_moves, using_db=connection)
+                for (games, wins, losses), user_ids in groups.items():
+                    await User.filter(pk__in=user_ids).using_db(connection).update(
+                        all_games=F('all_games') + games, wins=F('wins') + wins, losses=F('losses') + losses,
+                        playing_now=False)
+        except Exception:
+            for match, match_moves in zip(matches, moves):
+                match.restore_pending_moves(match_moves)
+            raise
+        # Queryset updates do not send signals
+        for match in matches:
+            for user in (match.white_player, match.black_player):
+                user.playing_now = False
+                await user_cache.evict(user.username)
+
+
+game_results = GameResults()
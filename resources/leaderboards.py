@@ -0,0 +1,97 @@
+from aioredis import Redis
+
+from data.models import Match, User
+from engine import WHITE, BLACK
+from resources.live_matches import live_matches
+
+# Sorted sets of usernames scored like User.get_swiss_system_rating: 1 for a win, 0.5 for a draw
+GLOBAL_KEY = 'lb:global'
+
+
+def country_key(country: str) -> str:
+    return f'lb:country:{country.lower()}'
+
+
+def tournament_key(tournament_id: int) -> str:
+    return f'lb:tournament:{tournament_id}'
+
+
+def leaderboard_key(country: str = None, tournament_id: int = None) -> str:
+    if tournament_id is not None:
+        return tournament_key(tournament_id)
+    if country:
+        return country_key(country)
+    return GLOBAL_KEY
+
+
+def _entries(rows, first_rank: int) -> list[dict]:
+    return [{'rank': first_rank + i, 'username': username.decode('utf-8'), 'score': score}
+            for i, (username, score) in enumerate(rows)]
+
+
+class Leaderboards:
+    def __init__(self):
+        self.redis: Redis | None = None
+
+    def start(self, redis: Redis):
+        self.redis = redis
+
+    async def record(self, match: Match):
+        # Both players are added even with no points, so every player who finished a game has a rank
+        results = ((match.white_player, 1 if match.winner == WHITE else 0.5 if match.winner == 0 else 0),
+                   (match.black_player, 1 if match.winner == BLACK else 0.5 if match.winner == 0 else 0))
+        pipe = self.redis.pipeline(transaction=False)
+        for user, points in results:
+            pipe.zincrby(GLOBAL_KEY, points, user.username)
+            pipe.zincrby(country_key(user.country), points, user.username)
+            if match.tournament_id is not None:
+                pipe.zincrby(tournament_key(match.tournament_id), points, user.username)
+        await pipe.execute()
+
+    async def add_points(self, key: str, username: str, points: float):
+        await self.redis.zincrby(key, points, username)
+
+    async def move_country(self, username: str, old_country: str, new_country: str):
+        score = await self.redis.zscore(country_key(old_country), username)
+        if score is not None:
+            pipe = self.redis.pipeline(transaction=True)
+            pipe.zrem(country_key(old_country), username)
+            pipe.zadd(country_key(new_country), {username: score})
+            await pipe.execute()
+
+    async def top(self, key: str, limit: int) -> list[dict]:
+        return _entries(await self.redis.zrevrange(key, 0, limit - 1, withscores=True), 1)
+
+    async def rank(self, key: str, username: str) -> dict | None:
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.zrevrank(key, username)
+        pipe.zscore(key, username)
+        rank, score = await pipe.execute()
+        if rank is None:
+            return None
+        return {'rank': rank + 1, 'username': username, 'score': score}
+
+    async def around(self, key: str, username: str, count: int) -> list[dict] | None:
+        # count players above and below the user
+        rank = await self.redis.zrevrank(key, username)
+        if rank is None:
+            return None
+        start = max(rank - count, 0)
+        return _entries(await self.redis.zrevrange(key, start, rank + count, withscores=True), start + 1)
+
+    async def rebuild(self, batch_size: int = 1000) -> int:
+        # Scores every user from the stored statistics, for players whose games ended before leaderboards existed
+        await self.redis.delete(GLOBAL_KEY, *[key async for key in self.redis.scan_iter('lb:country:*')])
+        users = await User.all().values_list('username', 'country', 'all_games', 'wins', 'losses')
+        for i in range(0, len(users), batch_size):
+            pipe = self.redis.pipeline(transaction=False)
+            for username, country, all_games, wins, losses in users[i:i + batch_size]:
+                score = wins + (all_games - wins - losses) * 0.5
+                pipe.zadd(GLOBAL_KEY, {username: score})
+                pipe.zadd(country_key(country), {username: score})
+            await pipe.execute()
+        return len(users)
+
+
+leaderboards = Leaderboards()
+live_matches.on_finish(leaderboards.record)
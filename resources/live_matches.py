@@ -0,0 +1,249 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+from tortoise.exceptions import ValidationError
+from tortoise.expressions import Q
+
+from config import LIVE_MATCH_FLUSH_SECONDS, DEFAULT_TIME_CONTROL
+from data.models import Match, User, Tournament
+from engine import QUEEN, WHITE, BLACK, opponent
+from resources.clocks import clocks
+from resources.game_results import game_results
+from resources.ws_bus import bus, online_users
+
+# Fields changed by a move, written behind on the flush schedule
+MOVE_FIELDS = ('board', 'now_turn', 'position_hash', 'plies', 'during_1', 'during_2')
+
+
+def parse_time_control(time_control: str) -> tuple[timedelta, timedelta]:
+    # '3+2' -> 3 minutes per player and 2 seconds added after every move
+    minutes, increment = time_control.split('+')
+    return timedelta(minutes=int(minutes)), timedelta(seconds=int(increment))
+
+
+class LiveMatchStore:
+    # A match is owned by the worker holding the white player's socket, only the owner keeps it in memory
+    # and applies moves, other workers route to it through the message bus
+    def __init__(self, flush_interval: float = LIVE_MATCH_FLUSH_SECONDS):
+        self.flush_interval = flush_interval
+        self._matches: dict[int, Match] = {}
+        self._players: dict[int, int] = {}
+        # Players of this worker in matches owned elsewhere: user id -> (match id, owner username)
+        self._remote: dict[int, tuple[int, str]] = {}
+        self._dirty: set[int] = set()
+        self._flush_task: asyncio.Task | None = None
+        self._finish_handlers = []
+        # A flush and the result commit of the same match must not write its moves at the same time
+        self._save_locks: dict[int, asyncio.Lock] = {}
+
+    def start(self):
+        clocks.start(self._flag_expired)
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        clocks.stop()
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
+
+    def on_finish(self, handler):
+        # handler(match) runs after a match has ended and was saved
+        self._finish_handlers.append(handler)
+        return handler
+
+    async def create(self, white: User, black: User, time_control: str = DEFAULT_TIME_CONTROL,
+                     tournament: Tournament = None) -> Match:
+        base, increment = parse_time_control(time_control)
+        match = await Match.create(white_player=white, black_player=black, during_1=base, during_2=base,
+                                   increment=increment, tournament=tournament)
+        white.playing_now = black.playing_now = True
+        await white.save(update_fields=('playing_now',))
+        await black.save(update_fields=('playing_now',))
+        if self.is_owner(match):
+            self._register(match)
+        else:
+            # The owner starts the clock
+            await bus.command(self.owner_of(match), 'match-load', match_id=match.pk)
+        return match
+
+    async def add(self, match: Match) -> Match:
+        # Players are kept loaded so move handlers can reach the opponent without a query
+        await match.fetch_related('white_player', 'black_player')
+        self._register(match)
+        return match
+
+    def _register(self, match: Match):
+        self._matches[match.pk] = match
+        self._players[match.white_player_id] = match.pk
+        self._players[match.black_player_id] = match.pk
+        clocks.track(match)
+
+    async def _load(self, match: Match | None) -> Match | None:
+        if match is not None:
+            await match.fetch_related('white_player', 'black_player')
+            if self.is_owner(match):
+                await match.restore_position()
+                self._register(match)
+        return match
+
+    async def get(self, match_id: int) -> Match | None:
+        match = self._matches.get(match_id)
+        if match is None:
+            match = await self._load(await Match.get_or_none(pk=match_id, winner=-1))
+        return match
+
+    async def for_player(self, user: User) -> Match | None:
+        match_id = self._players.get(user.pk)
+        if match_id is not None:
+            return self._matches[match_id]
+        return await self._load(await Match.filter(Q(white_player=user) | Q(black_player=user), winner=-1).first())
+
+    async def owner_for(self, user: User) -> str | None:
+        # Username owning the user's live match, remembered when another worker owns it so routing a move to the
+        # owner needs no query
+        match_id = self._players.get(user.pk)
+        if match_id is not None:
+            return self.owner_of(self._matches[match_id])
+        remote = self._remote.get(user.pk)
+        if remote is None:
+            match = await self.for_player(user)
+            if match is None:
+                return None
+            if self.is_owner(match):
+                return self.owner_of(match)
+            remote = self._remote[user.pk] = (match.pk, self.owner_of(match))
+        return remote[1]
+
+    def forget(self, user_id: int, match_id: int = None):
+        # Drops the remembered owner, only when it still belongs to match_id if given
+        remote = self._remote.get(user_id)
+        if remote is not None and match_id in (None, remote[0]):
+            del self._remote[user_id]
+
+    @staticmethod
+    def owner_of(match: Match) -> str:
+        return match.white_player.username
+
+    def is_owner(self, match: Match) -> bool:
+        return self.owner_of(match) in online_users
+
+    async def move(self, match: Match, from_at: str, to_at: str, promotion: int = QUEEN) -> str | None:
+        elapsed = clocks.elapsed(match)
+        # No running clock means the flag fell and the game is being finished
+        status = match.apply_move(from_at, to_at, promotion, elapsed) if elapsed is not None else 'Time is over!'
+        if status == 'Time is over!':
+            await self.flag(match)
+            raise ValidationError('Your time is over')
+        if status is None:
+            self._dirty.add(match.pk)
+            clocks.track(match)
+        else:
+            # now_turn is already the side that cannot move
+            await self.finish(match, 0 if status != 'Checkmate!' else opponent(match.now_turn))
+        return status
+
+    async def forfeit(self, match: Match, loser: User):
+        winner_user = self.opponent_of(match, loser)
+        await self.finish(match, self.color_of(match, winner_user))
+        await bus.send(
+            winner_user.username,
+            {'event': 'player-offline', 'task_id': 0, 'forward_from': loser.username, 'error': None}
+        )
+
+    async def flag(self, match: Match):
+        # The side to move ran out of time
+        if match.winner != -1:
+            return
+        if match.now_turn == WHITE:
+            match.during_1 = timedelta(0)
+        else:
+            match.during_2 = timedelta(0)
+        winner = opponent(match.now_turn)
+        await self.finish(match, winner)
+        for user in (match.white_player, match.black_player):
+            await bus.send(user.username, {
+                'event': 'time-over', 'task_id': 0, 'forward_from': 'server', 'error': None, 'match_id': match.pk,
+                'winner': winner,
+            })
+
+    async def _flag_expired(self, match_id: int):
+        match = self._matches.get(match_id)
+        if match is not None:
+            await self.flag(match)
+
+    async def finish(self, match: Match, winner: int):
+        # Both players leaving at once must not count the game twice
+        if match.winner != -1:
+            return
+        match.winner = winner
+        match.finished_at = datetime.now()
+        clocks.untrack(match.pk)
+        self._matches.pop(match.pk, None)
+        self._players.pop(match.white_player_id, None)
+        self._players.pop(match.black_player_id, None)
+        self._dirty.discard(match.pk)
+        # The match row and both players' counters are written in one transaction
+        async with self._save_lock(match.pk):
+            await game_results.commit(match)
+        self._save_locks.pop(match.pk, None)
+        # Workers of the players remember the owner of the match until it ends
+        for user in (match.white_player, match.black_player):
+            if user.username not in online_users:
+                await bus.command(user.username, 'match-finished', user_id=user.pk, match_id=match.pk)
+        # Subscribers are independent, one failing must not skip the others or the caller
+        for handler in self._finish_handlers:
+            try:
+                await handler(match)
+            except Exception:
+                logging.exception('Finish handler %s of match %s failed', handler.__qualname__, match.pk)
+
+    @staticmethod
+    def opponent_of(match: Match, user: User) -> User:
+        return match.black_player if match.white_player_id == user.pk else match.white_player
+
+    @staticmethod
+    def color_of(match: Match, user: User) -> int:
+        return WHITE if match.white_player_id == user.pk else BLACK
+
+    async def flush(self):
+        dirty, self._dirty = self._dirty, set()
+        for match_id in dirty:
+            match = self._matches.get(match_id)
+            if match is None:
+                continue
+            try:
+                async with self._save_lock(match_id):
+                    await match.save_moves()
+                    await match.save(update_fields=MOVE_FIELDS)
+            except Exception:
+                # Only the failing match is written again next time, the others still are now
+                logging.exception('Flushing match %s failed', match_id)
+                self._dirty.add(match_id)
+
+    def _save_lock(self, match_id: int) -> asyncio.Lock:
+        return self._save_locks.setdefault(match_id, asyncio.Lock())
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logging.exception('Live match flush failed')
+
+
+live_matches = LiveMatchStore()
+
+
+# Run on the worker of the white player when a match was created on another worker
+@bus.on_command('match-load')
+async def match_load_command(match_id: int):
+    await live_matches.get(match_id)
+
+
+@bus.on_command('match-finished')
+async def match_finished_command(user_id: int, match_id: int):
+    live_matches.forget(user_id, match_id)
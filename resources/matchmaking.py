@@ -0,0 +1,162 @@
+import asyncio
+import logging
+import random
+import time
+
+from aioredis import Redis
+
+from config import (TIME_CONTROLS, MATCHMAKING_TICK_SECONDS, MATCHMAKING_RATING_BAND, MATCHMAKING_BAND_GROWTH,
+                    MATCHMAKING_MAX_WAIT_SECONDS)
+from data.models import User
+from resources.live_matches import live_matches
+from resources.ws_bus import bus
+
+# Waiting players of a time control are a sorted set 'mm:pool:<time control>' of usernames scored by rating,
+# 'mm:waiting' maps username -> '<time control>|<joined at ms>' so a player seeks one time control at a time
+WAITING_KEY = 'mm:waiting'
+LEADER_KEY = 'mm:leader'
+
+# KEYS: pool, waiting; ARGV: username, rating, waiting value
+JOIN_SCRIPT = """
+if redis.call('HEXISTS', KEYS[2], ARGV[1]) == 1 then
+    return 0
+end
+redis.call('ZADD', KEYS[1], ARGV[2], ARGV[1])
+redis.call('HSET', KEYS[2], ARGV[1], ARGV[3])
+return 1
+"""
+# KEYS: waiting; ARGV: username
+LEAVE_SCRIPT = """
+local waiting = redis.call('HGET', KEYS[1], ARGV[1])
+if not waiting then
+    return 0
+end
+local time_control = string.match(waiting, '^[^|]+')
+redis.call('ZREM', 'mm:pool:' .. time_control, ARGV[1])
+redis.call('HDEL', KEYS[1], ARGV[1])
+return 1
+"""
+# KEYS: pool, waiting; ARGV: usernames in pairs. Returns the pairs whose both players were still waiting
+PAIR_SCRIPT = """
+local paired = {}
+for i = 1, #ARGV, 2 do
+    if redis.call('ZSCORE', KEYS[1], ARGV[i]) and redis.call('ZSCORE', KEYS[1], ARGV[i + 1]) then
+        redis.call('ZREM', KEYS[1], ARGV[i], ARGV[i + 1])
+        redis.call('HDEL', KEYS[2], ARGV[i], ARGV[i + 1])
+        table.insert(paired, ARGV[i])
+        table.insert(paired, ARGV[i + 1])
+    end
+end
+return paired
+"""
+
+
+def pool_key(time_control: str) -> str:
+    return f'mm:pool:{time_control}'
+
+
+def pair_players(entries: list[tuple[str, float]], joined: dict[str, int], now: int) -> list[tuple[str, str]]:
+    # entries are sorted by rating, neighbours are paired when their difference fits the band,
+    # which widens with the wait of the longer waiting one
+    pairs = []
+    i = 0
+    while i < len(entries) - 1:
+        (first, first_rating), (second, second_rating) = entries[i], entries[i + 1]
+        waited = (now - min(joined.get(first, now), joined.get(second, now))) / 1000
+        if second_rating - first_rating <= MATCHMAKING_RATING_BAND + MATCHMAKING_BAND_GROWTH * waited:
+            pairs.append((first, second))
+            i += 2
+        else:
+            i += 1
+    return pairs
+
+
+class MatchmakingPool:
+    # Seeks are shared by all workers in Redis, one worker at a time holds the leader key and pairs them every tick
+    def __init__(self, interval: float = MATCHMAKING_TICK_SECONDS):
+        self.interval = interval
+        self.redis: Redis | None = None
+        self._task: asyncio.Task | None = None
+        self._join = None
+        self._leave = None
+        self._pair = None
+
+    def start(self, redis: Redis):
+        self.redis = redis
+        self._join = redis.register_script(JOIN_SCRIPT)
+        self._leave = redis.register_script(LEAVE_SCRIPT)
+        self._pair = redis.register_script(PAIR_SCRIPT)
+        if self._task is None:
+            self._task = asyncio.create_task(self._tick_loop())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def join(self, user: User, time_control: str) -> bool:
+        rating = await user.get_swiss_system_rating()
+        waiting = f'{time_control}|{int(time.time() * 1000)}'
+        return bool(await self._join(keys=[pool_key(time_control), WAITING_KEY], args=[user.username, rating, waiting]))
+
+    async def leave(self, username: str) -> bool:
+        return bool(await self._leave(keys=[WAITING_KEY], args=[username]))
+
+    async def tick(self):
+        if not await self.redis.set(LEADER_KEY, bus.worker_id, nx=True, px=int(self.interval * 1000)):
+            return
+        now = int(time.time() * 1000)
+        joined = {}
+        for username, waiting in (await self.redis.hgetall(WAITING_KEY)).items():
+            username = username.decode('utf-8')
+            joined[username] = int(waiting.split(b'|')[1])
+            if now - joined[username] > MATCHMAKING_MAX_WAIT_SECONDS * 1000:
+                await self.leave(username)
+        for time_control in TIME_CONTROLS:
+            entries = await self.redis.zrange(pool_key(time_control), 0, -1, withscores=True)
+            pairs = pair_players([(username.decode('utf-8'), rating) for username, rating in entries], joined, now)
+            if not pairs:
+                continue
+            paired = await self._pair(keys=[pool_key(time_control), WAITING_KEY],
+                                      args=[username for pair in pairs for username in pair])
+            await asyncio.gather(*(self._start(paired[i].decode('utf-8'), paired[i + 1].decode('utf-8'), time_control)
+                                   for i in range(0, len(paired), 2)))
+
+    async def _start(self, first: str, second: str, time_control: str):
+        try:
+            await self._start_match(first, second, time_control)
+        except Exception:
+            # The pair script already took both out of the pool, they wait again instead of losing their seek
+            logging.exception('Starting the match of %s and %s failed', first, second)
+            for user in await User.filter(username__in=(first, second), playing_now=False):
+                await self.join(user, time_control)
+
+    async def _start_match(self, first: str, second: str, time_control: str):
+        # Read from the database, the cached rows of this worker may not know about a game started elsewhere
+        players = await User.filter(username__in=(first, second))
+        available = [user for user in players if not user.playing_now and await bus.is_online(user.username)]
+        if len(available) < 2:
+            # The pair script already took both out of the pool, whoever can still play waits again
+            for user in available:
+                await self.join(user, time_control)
+            return
+        random.shuffle(players)
+        white, black = players
+        match = await live_matches.create(white, black, time_control)
+        for user in players:
+            await bus.send(user.username, {
+                'event': 'match-found', 'task_id': 0, 'forward_from': 'server', 'error': None, 'match_id': match.pk,
+                'white': white.username, 'black': black.username, 'time_control': time_control,
+                **match.clock_state(),
+            })
+
+    async def _tick_loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.tick()
+            except Exception:
+                logging.exception('Matchmaking tick failed')
+
+
+matchmaking = MatchmakingPool()
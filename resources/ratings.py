@@ -0,0 +1,132 @@
+from datetime import datetime
+
+import numpy as np
+
+from config import ELO_K_FACTOR, GLICKO_TAU
+from data.models import Match, User, RatingHistory
+from engine import WHITE, BLACK
+from resources.live_matches import live_matches
+
+GLICKO_SCALE = 173.7178  # Glicko-2 works on (rating - 1500) / GLICKO_SCALE
+MAX_DEVIATION = 350
+VOLATILITY_EPSILON = 1e-6
+VOLATILITY_ITERATIONS = 100
+USER_BATCH_SIZE = 1000
+
+
+def elo_update(rating: float, opponent_rating: float, score: float, k: float = ELO_K_FACTOR) -> float:
+    expected = 1 / (1 + 10 ** ((opponent_rating - rating) / 400))
+    return rating + k * (score - expected)
+
+
+def _volatilities(delta2, phi2, v, sigma, tau):
+    # Illinois iteration of step 5 of the Glicko-2 paper, run for all players at once
+    a = np.log(sigma ** 2)
+
+    def f(x):
+        ex = np.exp(x)
+        return ex * (delta2 - phi2 - v - ex) / (2 * (phi2 + v + ex) ** 2) - (x - a) / tau ** 2
+
+    big = delta2 > phi2 + v
+    upper = np.log(np.where(big, delta2 - phi2 - v, 1))
+    k = np.ones_like(a)
+    searching = ~big
+    while searching.any():
+        searching &= f(a - k * tau) < 0
+        k += searching
+    A, B = a, np.where(big, upper, a - k * tau)
+    fA, fB = f(A), f(B)
+    for _ in range(VOLATILITY_ITERATIONS):
+        active = np.abs(B - A) > VOLATILITY_EPSILON
+        if not active.any():
+            break
+        C = A + (A - B) * fA / (fB - fA)
+        fC = f(C)
+        crossed = fC * fB <= 0
+        A = np.where(active & crossed, B, A)
+        fA = np.where(active, np.where(crossed, fB, fA / 2), fA)
+        B = np.where(active, C, B)
+        fB = np.where(active, fC, fB)
+    return np.exp(A / 2)
+
+
+def glicko2_period(ratings: np.ndarray, deviations: np.ndarray, volatilities: np.ndarray, white: np.ndarray,
+                   black: np.ndarray, white_scores: np.ndarray, tau: float = GLICKO_TAU):
+    # One rating period over all games: white/black are player indexes into the rating arrays and white_scores
+    # are 1, 0.5 or 0 per game. Returns the new ratings, deviations and volatilities
+    count = len(ratings)
+    mu = (ratings - 1500) / GLICKO_SCALE
+    phi = deviations / GLICKO_SCALE
+    # Every game is seen from both sides
+    players = np.concatenate((white, black))
+    opponents = np.concatenate((black, white))
+    scores = np.concatenate((white_scores, 1 - white_scores))
+    g = 1 / np.sqrt(1 + 3 * phi[opponents] ** 2 / np.pi ** 2)
+    expected = 1 / (1 + np.exp(-g * (mu[players] - mu[opponents])))
+    information = np.bincount(players, weights=g ** 2 * expected * (1 - expected), minlength=count)
+    improvement = np.bincount(players, weights=g * (scores - expected), minlength=count)
+
+    played = information > 0
+    new_mu, new_phi, new_sigma = mu.copy(), phi.copy(), volatilities.copy()
+    v = 1 / information[played]
+    delta = v * improvement[played]
+    phi2 = phi[played] ** 2
+    new_sigma[played] = _volatilities(delta ** 2, phi2, v, volatilities[played], tau)
+    pre_phi = np.sqrt(phi2 + new_sigma[played] ** 2)
+    new_phi[played] = 1 / np.sqrt(1 / pre_phi ** 2 + 1 / v)
+    new_mu[played] = mu[played] + new_phi[played] ** 2 * improvement[played]
+    # Players without games only become less certain
+    new_phi[~played] = np.sqrt(phi[~played] ** 2 + volatilities[~played] ** 2)
+    new_phi = np.minimum(new_phi, MAX_DEVIATION / GLICKO_SCALE)
+    return new_mu * GLICKO_SCALE + 1500, new_phi * GLICKO_SCALE, new_sigma
+
+
+class RatingService:
+    async def record(self, match: Match):
+        # Elo is updated right after every game
+        white, black = match.white_player, match.black_player
+        white_score = 1 if match.winner == WHITE else 0.5 if match.winner == 0 else 0
+        white_rating = elo_update(white.rating, black.rating, white_score)
+        black_rating = elo_update(black.rating, white.rating, 1 - white_score)
+        white.rating, black.rating = white_rating, black_rating
+        await white.save(update_fields=('rating',))
+        await black.save(update_fields=('rating',))
+        await RatingHistory.bulk_create([
+            RatingHistory(user_id=white.pk, system='elo', rating=white_rating, match_id=match.pk),
+            RatingHistory(user_id=black.pk, system='elo', rating=black_rating, match_id=match.pk),
+        ])
+
+    async def rating_period(self, start: datetime, end: datetime) -> int:
+        # Glicko-2 for every user over the games finished in [start, end), returns the number of games
+        games = await Match.filter(finished_at__gte=start, finished_at__lt=end, winner__gte=0).values_list(
+            'white_player_id', 'black_player_id', 'winner')
+        users = await User.all().only('id', 'glicko_rating', 'glicko_deviation', 'glicko_volatility')
+        index = {user.pk: i for i, user in enumerate(users)}
+        games = [game for game in games if game[0] in index and game[1] in index]
+        white = np.array([index[game[0]] for game in games], dtype=np.intp)
+        black = np.array([index[game[1]] for game in games], dtype=np.intp)
+        winners = np.array([game[2] for game in games], dtype=np.int8)
+        white_scores = np.where(winners == WHITE, 1.0, np.where(winners == BLACK, 0.0, 0.5))
+        ratings, deviations, volatilities = glicko2_period(
+            np.array([user.glicko_rating for user in users], dtype=np.float64),
+            np.array([user.glicko_deviation for user in users], dtype=np.float64),
+            np.array([user.glicko_volatility for user in users], dtype=np.float64),
+            white, black, white_scores,
+        )
+        played = set(white.tolist()) | set(black.tolist())
+        history = []
+        for i, user in enumerate(users):
+            user.glicko_rating = float(ratings[i])
+            user.glicko_deviation = float(deviations[i])
+            user.glicko_volatility = float(volatilities[i])
+            if i in played:
+                history.append(RatingHistory(user_id=user.pk, system='glicko2', rating=user.glicko_rating,
+                                             deviation=user.glicko_deviation))
+        await User.bulk_update(users, fields=['glicko_rating', 'glicko_deviation', 'glicko_volatility'],
+                               batch_size=USER_BATCH_SIZE)
+        await RatingHistory.bulk_create(history, batch_size=USER_BATCH_SIZE)
+        return len(games)
+
+
+ratings = RatingService()
+live_matches.on_finish(ratings.record)
@@ -0,0 +1,72 @@
+from resources.ws_bus import bus, bus_codec
+
+
+def match_channel(match_id: int) -> str:
+    return f'ws:match:{match_id}'
+
+
+class SpectatorRooms:
+    # Every update is encoded once and published once, workers with viewers of the match deliver it locally.
+    # Updates are queued keyed by match, so a slow viewer's outbox keeps only the newest unsent one.
+    def __init__(self):
+        self._rooms: dict[int, set] = {}
+        self._viewing: dict[object, set[int]] = {}
+
+    def is_viewing(self, match_id: int, manager) -> bool:
+        return manager in self._rooms.get(match_id, ())
+
+    def viewers(self, match_id: int) -> int:
+        return len(self._rooms.get(match_id, ()))
+
+    async def subscribe(self, match_id: int, manager) -> bool:
+        room = self._rooms.get(match_id)
+        if room is None:
+            room = self._rooms[match_id] = set()
+            await bus.subscribe(match_channel(match_id))
+        elif manager in room:
+            return False
+        room.add(manager)
+        self._viewing.setdefault(manager, set()).add(match_id)
+        return True
+
+    async def unsubscribe(self, match_id: int, manager):
+        room = self._rooms.get(match_id)
+        if room is None or manager not in room:
+            return
+        room.discard(manager)
+        viewing = self._viewing.get(manager)
+        if viewing is not None:
+            viewing.discard(match_id)
+            if not viewing:
+                del self._viewing[manager]
+        if not room:
+            del self._rooms[match_id]
+            await bus.unsubscribe(match_channel(match_id))
+
+    async def leave_all(self, manager):
+        for match_id in list(self._viewing.get(manager, ())):
+            await self.unsubscribe(match_id, manager)
+
+    async def broadcast(self, match_id: int, payload: dict):
+        text = bus_codec.dumps(payload)
+        self._deliver(match_id, text)
+        await bus.publish(match_channel(match_id), f'{bus.worker_id}:{text}')
+
+    async def _deliver_remote(self, match_id: str, message: str):
+        worker_id, text = message.split(':', 1)
+        if worker_id != bus.worker_id:
+            self._deliver(int(match_id), text)
+
+    def _deliver(self, match_id: int, text: str):
+        key = ('match', match_id)
+        frames = {}
+        for manager in self._rooms.get(match_id, ()):
+            codec = manager.codec
+            frame = frames.get(codec.name)
+            if frame is None:
+                frame = frames[codec.name] = codec.from_json(text)
+            manager.send_frame(frame, key)
+
+
+spectators = SpectatorRooms()
+bus.on_channel('ws:match:', spectators._deliver_remote)
@@ -0,0 +1,109 @@
+from bisect import bisect_left, insort
+from itertools import groupby
+
+from engine import WHITE, BLACK
+
+
+class Standing:
+    # points are counted in halves: 2 for a win or a bye, 1 for a draw
+    __slots__ = ('user_id', 'points', 'opponents', 'color_balance', 'last_color', 'had_bye')
+
+    def __init__(self, user_id: int, points: int = 0, had_bye: bool = False):
+        self.user_id = user_id
+        self.points = points
+        self.opponents: set[int] = set()
+        self.color_balance = 0  # games with white minus games with black
+        self.last_color = 0
+        self.had_bye = had_bye
+
+    @property
+    def key(self) -> tuple[int, int]:
+        return -self.points, self.user_id
+
+    def add_game(self, opponent_id: int, color: int):
+        self.opponents.add(opponent_id)
+        self.color_balance += 1 if color == WHITE else -1
+        self.last_color = color
+
+
+class SwissStandings:
+    # Players are kept sorted by points in a list of keys, a result moves only the two players involved
+    def __init__(self):
+        self._players: dict[int, Standing] = {}
+        self._keys: list[tuple[int, int]] = []
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def add(self, standing: Standing):
+        self._players[standing.user_id] = standing
+        insort(self._keys, standing.key)
+
+    def get(self, user_id: int) -> Standing | None:
+        return self._players.get(user_id)
+
+    def add_points(self, user_id: int, points: int):
+        standing = self._players[user_id]
+        del self._keys[bisect_left(self._keys, standing.key)]
+        standing.points += points
+        insort(self._keys, standing.key)
+
+    def add_game(self, white_id: int, black_id: int):
+        self._players[white_id].add_game(black_id, WHITE)
+        self._players[black_id].add_game(white_id, BLACK)
+
+    def record(self, white_id: int, black_id: int, winner: int):
+        # winner as in Match: 0-draw, 1-white, 2-black
+        if winner == 0:
+            self.add_points(white_id, 1)
+            self.add_points(black_id, 1)
+        else:
+            self.add_points(white_id if winner == WHITE else black_id, 2)
+
+    def ranking(self, limit: int = None) -> list[Standing]:
+        keys = self._keys if limit is None else self._keys[:limit]
+        return [self._players[user_id] for _, user_id in keys]
+
+
+def _colors(first: Standing, second: Standing) -> tuple[Standing, Standing]:
+    # White goes to the player who had it less, then to the one who had black last, then to the higher ranked one
+    if first.color_balance != second.color_balance:
+        return (first, second) if first.color_balance < second.color_balance else (second, first)
+    if first.last_color != second.last_color:
+        return (first, second) if first.last_color != WHITE else (second, first)
+    return first, second
+
+
+def _pair_group(group: list[Standing]) -> tuple[list[tuple[Standing, Standing]], list[Standing]]:
+    # The top half meets the bottom half, a rematch moves on to the next player of the bottom half
+    half = len(group) // 2
+    bottom = group[half:]
+    pairs, floaters = [], []
+    for player in group[:half]:
+        for i, candidate in enumerate(bottom):
+            if candidate.user_id not in player.opponents:
+                pairs.append((player, bottom.pop(i)))
+                break
+        else:
+            floaters.append(player)
+    return pairs, floaters + bottom
+
+
+def pair_round(standings: SwissStandings) -> tuple[list[tuple[Standing, Standing]], Standing | None]:
+    # Returns (white, black) pairs and the player getting the bye. Score groups are paired from the top,
+    # players left unpaired float down to the next group
+    players = standings.ranking()
+    bye = None
+    if len(players) % 2:
+        index = next((i for i in range(len(players) - 1, -1, -1) if not players[i].had_bye), len(players) - 1)
+        bye = players.pop(index)
+    pairs, floaters = [], []
+    for _, group in groupby(players, key=lambda standing: standing.points):
+        group_pairs, floaters = _pair_group(floaters + list(group))
+        pairs += group_pairs
+    # Whoever could not avoid a rematch in the last group plays the closest remaining player
+    while floaters:
+        player = floaters.pop(0)
+        index = next((i for i, other in enumerate(floaters) if other.user_id not in player.opponents), 0)
+        pairs.append((player, floaters.pop(index)))
+    return [_colors(first, second) for first, second in pairs], bye
@@ -0,0 +1,141 @@
+from datetime import datetime
+
+from tortoise.expressions import F
+
+from data.models import Match, Tournament, TournamentParticipant, User
+from engine import WHITE, BLACK
+from resources.leaderboards import leaderboards, tournament_key
+from config import DEFAULT_TIME_CONTROL
+from resources.live_matches import live_matches, parse_time_control
+from resources.swiss import Standing, SwissStandings, pair_round
+from resources.ws_bus import bus
+
+# Changes made on one worker, '<worker id>:<tournament id>:<change>'. 'r:<white>:<black>:<winner>' is a result
+# applied to the loaded standings, 'd' drops them so they are loaded again
+TOURNAMENT_CHANNEL = 'ws:tournaments'
+
+
+def _result_updates(won: bool, lost: bool) -> dict:
+    updates = {'all_games': F('all_games') + 1}
+    if won:
+        updates['wins'] = F('wins') + 1
+    elif lost:
+        updates['losses'] = F('losses') + 1
+    return updates
+
+
+class TournamentService:
+    # Standings of a tournament are loaded once per worker and then kept up to date by results
+    def __init__(self):
+        self._standings: dict[int, SwissStandings] = {}
+
+    async def start(self):
+        bus.on_channel(TOURNAMENT_CHANNEL, self._on_message)
+        await bus.subscribe(TOURNAMENT_CHANNEL)
+
+    async def standings(self, tournament_id: int) -> SwissStandings:
+        standings = self._standings.get(tournament_id)
+        if standings is None:
+            standings = SwissStandings()
+            for participant in await TournamentParticipant.filter(tournament_id=tournament_id):
+                draws = participant.all_games - participant.wins - participant.losses
+                standings.add(Standing(participant.participant_id, 2 * participant.wins + draws, participant.had_bye))
+            # In creation order, the last game of a player decides its last colour
+            games = await Match.filter(tournament_id=tournament_id).order_by('id').values_list(
+                'white_player_id', 'black_player_id')
+            for white_id, black_id in games:
+                if standings.get(white_id) and standings.get(black_id):
+                    standings.add_game(white_id, black_id)
+            self._standings[tournament_id] = standings
+        return standings
+
+    async def join(self, tournament: Tournament, user: User) -> bool:
+        if await TournamentParticipant.exists(tournament=tournament, participant=user):
+            return False
+        await TournamentParticipant.create(tournament=tournament, participant=user)
+        standings = self._standings.get(tournament.pk)
+        if standings is not None:
+            standings.add(Standing(user.pk))
+        await self._publish(tournament.pk, 'd')
+        return True
+
+    async def pair_round(self, tournament: Tournament) -> tuple[list[Match], int | None]:
+        # Starts the next round, returns its matches and the id of the user getting the bye
+        standings = await self.standings(tournament.pk)
+        pairs, bye = pair_round(standings)
+        user_ids = [standing.user_id for pair in pairs for standing in pair] + ([bye.user_id] if bye else [])
+        users = {user.pk: user for user in await User.filter(pk__in=user_ids)}
+        tournament.round += 1
+        matches = []
+        for white, black in pairs:
+            white_user, black_user = users[white.user_id], users[black.user_id]
+            white_present, black_present = await self._present(white_user), await self._present(black_user)
+            if white_present and black_present:
+                standings.add_game(white.user_id, black.user_id)
+                match = await live_matches.create(white_user, black_user, tournament=tournament)
+                matches.append(match)
+                for user in (white_user, black_user):
+                    await bus.send(user.username, {
+                        'event': 'match-found', 'task_id': 0, 'forward_from': 'server', 'error': None,
+                        'match_id': match.pk, 'white': white_user.username, 'black': black_user.username,
+                        'time_control': DEFAULT_TIME_CONTROL, 'tournament_id': tournament.pk,
+                        'round': tournament.round, **match.clock_state(),
+                    })
+            elif white_present or black_present:
+                # A player who is offline or busy in another game loses the round by forfeit
+                standings.add_game(white.user_id, black.user_id)
+                await self._forfeit(tournament, white_user, black_user, WHITE if white_present else BLACK)
+            # When neither shows up the round is simply not played by either
+        if bye is not None:
+            bye.had_bye = True
+            standings.add_points(bye.user_id, 2)
+            await TournamentParticipant.filter(tournament=tournament, participant_id=bye.user_id).update(
+                had_bye=True, **_result_updates(True, False))
+            await leaderboards.add_points(tournament_key(tournament.pk), users[bye.user_id].username, 1)
+        await tournament.save(update_fields=('round',))
+        await self._publish(tournament.pk, 'd')
+        return matches, bye.user_id if bye else None
+
+    @staticmethod
+    async def _present(user: User) -> bool:
+        return not user.playing_now and await bus.is_online(user.username)
+
+    async def _forfeit(self, tournament: Tournament, white: User, black: User, winner: int):
+        # Stored as a finished match so it counts in the standings and is not paired again
+        base, increment = parse_time_control(DEFAULT_TIME_CONTROL)
+        match = await Match.create(white_player=white, black_player=black, tournament=tournament, during_1=base,
+                                   during_2=base, increment=increment, winner=winner, finished_at=datetime.now())
+        await self.record(match)
+        await leaderboards.add_points(tournament_key(tournament.pk), (white if winner == WHITE else black).username, 1)
+
+    async def record(self, match: Match):
+        if match.tournament_id is None:
+            return
+        white_id, black_id, winner = match.white_player_id, match.black_player_id, match.winner
+        participants = TournamentParticipant.filter(tournament_id=match.tournament_id)
+        await participants.filter(participant_id=white_id).update(**_result_updates(winner == WHITE, winner == BLACK))
+        await participants.filter(participant_id=black_id).update(**_result_updates(winner == BLACK, winner == WHITE))
+        self._record(match.tournament_id, white_id, black_id, winner)
+        await self._publish(match.tournament_id, f'r:{white_id}:{black_id}:{winner}')
+
+    def _record(self, tournament_id: int, white_id: int, black_id: int, winner: int):
+        standings = self._standings.get(tournament_id)
+        if standings is not None and standings.get(white_id) and standings.get(black_id):
+            standings.record(white_id, black_id, winner)
+
+    async def _publish(self, tournament_id: int, change: str):
+        await bus.publish(TOURNAMENT_CHANNEL, f'{bus.worker_id}:{tournament_id}:{change}')
+
+    async def _on_message(self, _, data: str):
+        worker_id, tournament_id, change = data.split(':', 2)
+        if worker_id == bus.worker_id:
+            return
+        if change == 'd':
+            self._standings.pop(int(tournament_id), None)
+        else:
+            _, white_id, black_id, winner = change.split(':')
+            self._record(int(tournament_id), int(white_id), int(black_id), int(winner))
+
+
+tournaments = TournamentService()
+live_matches.on_finish(tournaments.record)
@@ -0,0 +1,76 @@
+import time
+from collections import OrderedDict
+
+from tortoise.signals import pre_save, post_save, post_delete
+
+from config import USER_CACHE_TTL_SECONDS, USER_CACHE_SIZE
+from data.models import User
+from resources.ws_bus import bus
+
+# Usernames written on one worker, '<worker id>:<username>', every other worker drops its cached copy
+USER_CHANNEL = 'ws:users'
+
+
+class UserCache:
+    def __init__(self, ttl: float = USER_CACHE_TTL_SECONDS, maxsize: int = USER_CACHE_SIZE):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._users: OrderedDict[str, tuple[float, User]] = OrderedDict()
+
+    async def get(self, username: str) -> User | None:
+        entry = self._users.get(username)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                self._users.move_to_end(username)
+                return entry[1]
+            del self._users[username]
+        user = await User.get_or_none(username=username)
+        if user is not None:
+            self.put(user)
+        return user
+
+    def put(self, user: User):
+        self._users[user.username] = (time.monotonic() + self.ttl, user)
+        self._users.move_to_end(user.username)
+        if len(self._users) > self.maxsize:
+            self._users.popitem(last=False)
+
+    def invalidate(self, username: str):
+        self._users.pop(username, None)
+
+    def clear(self):
+        self._users.clear()
+
+    async def start(self):
+        bus.on_channel(USER_CHANNEL, self._on_message)
+        await bus.subscribe(USER_CHANNEL)
+
+    async def evict(self, username: str):
+        # Drops the user on every worker, roles are checked on cached rows
+        self.invalidate(username)
+        if bus.redis is not None:
+            await bus.publish(USER_CHANNEL, f'{bus.worker_id}:{username}')
+
+    async def _on_message(self, _, data: str):
+        worker_id, username = data.split(':', 1)
+        if worker_id != bus.worker_id:
+            self.invalidate(username)
+
+
+user_cache = UserCache()
+
+
+# Any write of a user row drops the cached copy, the next lookup reloads it
+@pre_save(User)
+async def _invalidate_before_save(sender, instance: User, using_db, update_fields):
+    user_cache.invalidate(instance.username)
+
+
+@post_save(User)
+async def _invalidate_after_save(sender, instance: User, created, using_db, update_fields):
+    await user_cache.evict(instance.username)
+
+
+@post_delete(User)
+async def _invalidate_after_delete(sender, instance: User, using_db):
+    await user_cache.evict(instance.username)
@@ -0,0 +1,184 @@
+import asyncio
+import logging
+import time
+from uuid import uuid4
+
+from aioredis import Redis
+
+from resources.ws_codec import CODECS
+
+PRESENCE_KEY = 'ws:presence'  # hash: username -> id of the worker holding the socket
+WORKER_TTL = 30
+
+# Drops the presence entry when the worker holding it stopped sending heartbeats
+IS_ONLINE_SCRIPT = """
+local worker = redis.call('HGET', KEYS[1], ARGV[1])
+if not worker then
+    return 0
+end
+if redis.call('EXISTS', 'ws:worker:' .. worker) == 1 then
+    return 1
+end
+redis.call('HDEL', KEYS[1], ARGV[1])
+return 0
+"""
+UNREGISTER_SCRIPT = """
+if redis.call('HGET', KEYS[1], ARGV[1]) == ARGV[2] then
+    return redis.call('HDEL', KEYS[1], ARGV[1])
+end
+return 0
+"""
+
+# Sockets connected to this worker: username -> WsManager
+online_users = {}
+# Messages between workers are always JSON, managers re-encode them only when their codec is not JSON
+bus_codec = CODECS.get('orjson', CODECS['json'])
+
+
+def user_channel(username: str) -> str:
+    return f'ws:user:{username}'
+
+
+class MessageBus:
+    # Frames for users on other workers go through their per-user channel, prefixed 'f'.
+    # Commands, prefixed 'c', run a registered handler on the worker holding the user's socket.
+    def __init__(self):
+        self.worker_id = uuid4().hex
+        self.redis: Redis | None = None
+        self._pubsub = None
+        self._listener: asyncio.Task | None = None
+        self._commands = {}
+        self._channels = {}
+        self._is_online = None
+        self._unregister = None
+        self._running: set[asyncio.Task] = set()
+
+    async def start(self, redis: Redis):
+        self.redis = redis
+        self._pubsub = redis.pubsub()
+        self._is_online = redis.register_script(IS_ONLINE_SCRIPT)
+        self._unregister = redis.register_script(UNREGISTER_SCRIPT)
+        await self._heartbeat()
+        self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            self._listener = None
+        if self._pubsub is not None:
+            await self._pubsub.close()
+        await self.redis.delete(f'ws:worker:{self.worker_id}')
+
+    def on_command(self, name: str):
+        def wrapper(func):
+            self._commands[name] = func
+            return func
+
+        return wrapper
+
+    def on_channel(self, prefix: str, handler):
+        # handler(channel suffix, message text) receives messages of channels subscribed with the prefix
+        self._channels[prefix] = handler
+
+    async def subscribe(self, channel: str):
+        await self._pubsub.subscribe(channel)
+
+    async def unsubscribe(self, channel: str):
+        await self._pubsub.unsubscribe(channel)
+
+    async def publish(self, channel: str, message: str) -> int:
+        return await self.redis.publish(channel, message)
+
+    async def register(self, username: str, manager):
+        online_users[username] = manager
+        await self.redis.hset(PRESENCE_KEY, username, self.worker_id)
+        await self._pubsub.subscribe(user_channel(username))
+
+    async def unregister(self, username: str):
+        online_users.pop(username, None)
+        await self._pubsub.unsubscribe(user_channel(username))
+        await self._unregister(keys=[PRESENCE_KEY], args=[username, self.worker_id])
+
+    async def is_online(self, username: str) -> bool:
+        return username in online_users or bool(await self._is_online(keys=[PRESENCE_KEY], args=[username]))
+
+    async def send(self, username: str, payload: dict) -> bool:
+        # Returns False when the user has no socket on any worker
+        manager = online_users.get(username)
+        if manager is not None:
+            manager.send(payload)
+            return True
+        return await self.redis.publish(user_channel(username), 'f' + bus_codec.dumps(payload)) > 0
+
+    async def send_envelope(self, username: str, event: str, task_id: int, forward_from: str, error: str | None,
+                            extra: dict = None) -> bool:
+        manager = online_users.get(username)
+        if manager is not None:
+            manager.send_envelope(event, task_id, forward_from, error, extra)
+            return True
+        message = 'f' + bus_codec.envelope(event, task_id, forward_from, error, extra)
+        return await self.redis.publish(user_channel(username), message) > 0
+
+    async def command(self, username: str, name: str, **kwargs) -> bool:
+        # Runs the command on the worker holding the user's socket
+        if username in online_users:
+            await self._commands[name](**kwargs)
+            return True
+        message = 'c' + bus_codec.dumps({'command': name, 'kwargs': kwargs})
+        return await self.redis.publish(user_channel(username), message) > 0
+
+    async def _run_command(self, name: str, kwargs: dict):
+        try:
+            await self._commands[name](**kwargs)
+        except Exception:
+            logging.exception('Bus command %s failed', name)
+
+    async def _heartbeat(self):
+        await self.redis.set(f'ws:worker:{self.worker_id}', int(time.time()), ex=WORKER_TTL)
+
+    async def _listen(self):
+        next_heartbeat = time.monotonic() + WORKER_TTL / 3
+        while True:
+            try:
+                if time.monotonic() >= next_heartbeat:
+                    await self._heartbeat()
+                    next_heartbeat = time.monotonic() + WORKER_TTL / 3
+                if not self._pubsub.subscribed:
+                    await asyncio.sleep(0.1)
+                    continue
+                message = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # Redis is unreachable, retry shortly
+                logging.exception('Message bus connection error')
+                await asyncio.sleep(1)
+                continue
+            if message is not None:
+                try:
+                    await self._dispatch(message)
+                except Exception:
+                    logging.exception('Message bus could not handle a message on %s', message.get('channel'))
+
+    async def _dispatch(self, message: dict):
+        channel = message['channel'].decode('utf-8')
+        data = message['data'].decode('utf-8')
+        if not channel.startswith('ws:user:'):
+            for prefix, handler in self._channels.items():
+                if channel.startswith(prefix):
+                    await handler(channel[len(prefix):], data)
+            return
+        username = channel[len('ws:user:'):]
+        if data[0] == 'c':
+            # Commands may wait on the database, the listener keeps delivering other messages meanwhile
+            command = bus_codec.loads(data[1:])
+            task = asyncio.create_task(self._run_command(command['command'], command['kwargs']))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+            return
+        manager = online_users.get(username)
+        if manager is not None:
+            manager.send_json_text(data[1:])
+
+
+bus = MessageBus()
@@ -0,0 +1,111 @@
+import json
+import struct
+
+from config import WS_CODEC
+from engine import decode_move, encode_move, square, square_name
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Binary move frame: frame type, task_id, 16-bit move code (6 bits from, 6 bits to, 4 bits promotion)
+MOVE_FRAME = struct.Struct('>BIH')
+MOVE_FRAME_TYPE = 1
+
+
+class JsonCodec:
+    # Text frames, bus messages are JSON so they are passed to the socket as they are
+    name = 'json'
+    binary = False
+
+    def dumps(self, payload: dict) -> str:
+        return json.dumps(payload, separators=(',', ':'))
+
+    def loads(self, data: str | bytes) -> dict:
+        return json.loads(data)
+
+    def from_json(self, text: str) -> str:
+        return text
+
+    def envelope(self, event: str, task_id: int, forward_from: str, error: str | None, extra: dict = None) -> str:
+        return self.dumps(
+            {'event': event, 'task_id': task_id, 'forward_from': forward_from, 'error': error, **(extra or {})})
+
+
+class OrjsonCodec(JsonCodec):
+    name = 'orjson'
+
+    def dumps(self, payload: dict) -> str:
+        return orjson.dumps(payload).decode('utf-8')
+
+    def loads(self, data: str | bytes) -> dict:
+        return orjson.loads(data)
+
+
+class MsgpackCodec:
+    name = 'msgpack'
+    binary = True
+
+    def dumps(self, payload: dict) -> bytes:
+        return msgpack.packb(payload)
+
+    def loads(self, data: str | bytes) -> dict:
+        return msgpack.unpackb(data) if isinstance(data, bytes) else json.loads(data)
+
+    def from_json(self, text: str) -> bytes:
+        return msgpack.packb(json.loads(text))
+
+    envelope = JsonCodec.envelope
+
+
+CODECS = {'json': JsonCodec()}
+if orjson is not None:
+    CODECS['orjson'] = OrjsonCodec()
+if msgpack is not None:
+    CODECS['msgpack'] = MsgpackCodec()
+# msgpack changes the wire format, clients have to ask for it
+DEFAULT_CODEC = CODECS.get('orjson', CODECS['json']) if WS_CODEC == 'auto' else CODECS[WS_CODEC]
+
+
+def get_codec(name: str | None):
+    return CODECS.get(name, DEFAULT_CODEC) if name else DEFAULT_CODEC
+
+
+def encode_move_frame(task_id: int, from_at: str, to_at: str, promotion: int = 0) -> bytes:
+    return MOVE_FRAME.pack(MOVE_FRAME_TYPE, task_id, encode_move(square(from_at), square(to_at), promotion))
+
+
+def decode_binary_frame(data: bytes, codec) -> dict:
+    if len(data) == MOVE_FRAME.size and data[0] == MOVE_FRAME_TYPE:
+        _, task_id, move = MOVE_FRAME.unpack(data)
+        from_sq, to_sq, promotion = decode_move(move)
+        frame = {'event': 'move', 'task_id': task_id, 'from_at': square_name(from_sq), 'to_at': square_name(to_sq)}
+        if promotion:
+            frame['promotion'] = promotion
+        return frame
+    return codec.loads(data)
+
+
+def benchmark(frames: int = 100000):
+    import timeit
+    payload = {'from_at': 'E2', 'to_at': 'E4', 'promotion': 2, 'status': None}
+    message = {'event': 'move', 'task_id': 42, 'forward_from': 'someone', 'error': None, **payload}
+    for codec in CODECS.values():
+        encoded = codec.dumps(message)
+        dict_time = timeit.timeit(lambda: codec.dumps(message), number=frames)
+        decode_time = timeit.timeit(lambda: codec.loads(encoded), number=frames)
+        print(f'{codec.name:<8} encode {dict_time / frames * 1e6:6.2f}us  decode {decode_time / frames * 1e6:6.2f}us'
+              f'  {len(encoded)} bytes')
+    move_frame = encode_move_frame(42, 'E2', 'E4')
+    move_time = timeit.timeit(lambda: decode_binary_frame(move_frame, DEFAULT_CODEC), number=frames)
+    print(f'{"binary":<8} move decode {move_time / frames * 1e6:6.2f}us  {len(move_frame)} bytes')
+
+
+if __name__ == '__main__':
+    benchmark()
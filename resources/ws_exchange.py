@@ -1,70 +1,132 @@
-from datetime import datetime
+import asyncio
+import inspect
+import logging
+import time
 
-import jwt
 from fastapi import WebSocket
-from jwt import InvalidTokenError
 from starlette.websockets import WebSocketDisconnect
 
-from config import SECRET_KEY, ALGORITHM
-from data.models import User, Match
+from data.models import User
+from resources.auth import decode_access_token
+from resources.live_matches import live_matches
+from resources.matchmaking import matchmaking
+from resources.spectators import spectators
+from resources.user_cache import user_cache
+from resources.ws_bus import bus, online_users
+from resources.ws_codec import get_codec, decode_binary_frame
+from resources.ws_outbox import Outbox
 
-online_users = {}
 ws_docs = {}
 
 
 class Event:
-    def __init__(self, event: str, task_id: int, websocket: WebSocket, current_user: User, receiver: User = None):
+    # Per-connection context of a handler call, manager is None for events run by a bus command
+    # and replies then go through the bus
+    def __init__(self, event: str, task_id: int, manager: 'WsManager | None', current_user: User,
+                 receiver: User = None):
         self._event = event
-        self._task_id = task_id
-        self._websocket = websocket
+        self.task_id = task_id
+        self.manager = manager
         self.current_user = current_user
         self.receiver = receiver
 
-    async def success(self):
-        await self._websocket.send_json(
-            {'event': self._event, 'task_id': self._task_id, 'forward_from': 'server', 'error': None, 'success': True})
+    async def _reply(self, error=None, **kwargs):
+        if self.manager is not None:
+            self.manager.send_envelope(self._event, self.task_id, 'server', error, kwargs)
+        else:
+            await bus.send_envelope(self.current_user.username, self._event, self.task_id, 'server', error, kwargs)
+
+    async def success(self, **kwargs):
+        await self._reply(success=True, **kwargs)
 
     async def reply_exception(self, error):
-        await self._websocket.send_json(
-            {'event': self._event, 'task_id': self._task_id, 'forward_from': 'server', 'error': error})
+        await self._reply(error)
 
     async def forward(self, **kwargs):
         receiver_user = self.receiver
         if not self.receiver:
             raise TypeError('Missing argument forward_to')
-        if receiver_user.username not in online_users:
-            return await self._websocket.send_json(
-                {'event': self._event, 'task_id': self._task_id, 'forward_from': 'server',
-                 'error': 'User is not online'})
-        receiver_web = online_users[receiver_user.username]
-        await receiver_web.websocket.send_json(
-            {'event': self._event, 'task_id': self._task_id, 'forward_from': self.current_user.username, 'error': None,
-             **kwargs}
-        )
+        delivered = await bus.send_envelope(
+            receiver_user.username, self._event, self.task_id, self.current_user.username, None, kwargs)
+        if not delivered:
+            return await self._reply('User is not online')
 
     async def receiver_exc(self):
         await self.reply_exception('You must give receiver user')
 
 
+class EventRouter:
+    # Handlers are registered once at import and shared by every connection
+    def __init__(self):
+        self.routes = {}
+        self.signatures = {}
+
+    def on_event(self, event: str):
+        def wrapper(func):
+            docs = dict(func.__annotations__)
+            docs.pop('event')
+            docs.update({'event': str, 'task_id': int, 'forward_to': str})
+            ws_docs[func.__name__] = docs
+            self.routes[event] = func
+            self.signatures[event] = inspect.signature(func)
+            return func
+
+        return wrapper
+
+
+ws_router = EventRouter()
+
+
 class WsManager:
     websocket: WebSocket
     _current_user: User
-    viewing_matches = []
-    _ws_routes = {}
 
     def __init__(self, websocket: WebSocket):
         self.websocket = websocket
+        self.codec = get_codec(websocket.query_params.get('codec'))
+        self.outbox = Outbox(websocket, on_close=self._close_slow_socket)
+        self._closed = False
+        # Session: the token is decoded once per connection, afterwards only its expiry is checked
+        self._username: str | None = None
+        self._session_expires: float = 0
+
+    def send(self, payload: dict, key=None):
+        self.outbox.put(self.codec.dumps(payload), key)
+
+    def send_envelope(self, event: str, task_id: int, forward_from: str, error: str | None, extra: dict = None):
+        self.outbox.put(self.codec.envelope(event, task_id, forward_from, error, extra))
+
+    def send_json_text(self, text: str, key=None):
+        self.outbox.put(self.codec.from_json(text), key)
+
+    def send_frame(self, frame: str | bytes, key=None):
+        # frame must already be encoded with self.codec
+        self.outbox.put(frame, key)
+
+    async def _receive(self) -> dict:
+        message = await self.websocket.receive()
+        if message['type'] == 'websocket.disconnect':
+            raise WebSocketDisconnect(message.get('code', 1000), message.get('reason'))
+        if message.get('text') is not None:
+            return self.codec.loads(message['text'])
+        return decode_binary_frame(message['bytes'], self.codec)
+
+    def _close_slow_socket(self):
+        if not self._closed:
+            asyncio.create_task(self._socket_break('Client is too slow'))
 
     async def socket_run(self):
         await self.websocket.accept()
         is_authenticated = await self._check_auth()
         if not is_authenticated:
             return await self.websocket.close(code=1008, reason="Not authenticated")
+        self.outbox.start()
         await self._current_user.update_status(online=True)
-        online_users[self._current_user.username] = self
+        await bus.register(self._current_user.username, self)
+        reason = 'Socket Disconnect'
         try:
             while True:
-                data: dict = await self.websocket.receive_json()
+                data: dict = await self._receive()
                 is_authenticated = await self._check_auth()
                 if not is_authenticated:
                     return await self._socket_break('Not authenticated')
@@ -74,47 +136,53 @@ class WsManager:
                     return await self._socket_break('Missing field: task_id')
                 if not isinstance(data['task_id'], int):
                     return await self._socket_break('task_id must be an integer')
-                if data['event'] in self._ws_routes:
-                    handler = self._ws_routes[data['event']]
+                handler = ws_router.routes.get(data['event'])
+                if handler is not None:
                     details = data.copy()
-                    details.pop('event')
-                    details.pop('forward_to', None)
-                    details.pop('task_id')
+                    event = details.pop('event')
+                    task_id = details.pop('task_id')
+                    receiver_user = None
                     if 'forward_to' in data:
-                        if not isinstance(data['forward_to'], str):
+                        forward_to = details.pop('forward_to')
+                        if not isinstance(forward_to, str):
                             return await self._socket_break('Receiver username must be str')
-                        receiver_user = await User.get_or_none(username=data['forward_to'])
+                        receiver_user = await user_cache.get(forward_to)
                         if not receiver_user:
                             return await self._socket_break('User not found')
-                        await handler(details, data['task_id'], receiver_user)
-                    else:
-                        await handler(details, data['task_id'])
+                    handler_event = Event(event, task_id, self, self._current_user, receiver_user)
+                    try:
+                        ws_router.signatures[event].bind(event=handler_event, **details)
+                    except TypeError as e:
+                        await handler_event.reply_exception(str(e))
+                        continue
+                    await handler(event=handler_event, **details)
         except WebSocketDisconnect:
-            return await self._socket_break('Socket Disconnect')
+            pass
+        except Exception:
+            logging.exception('Websocket of %s failed', self._current_user.username)
+            reason = 'Internal error'
+        finally:
+            # Whatever ended the loop, the user must not stay registered as online
+            await self._socket_break(reason)
 
     async def _socket_break(self, reason):
-        online_users.pop(self._current_user.username)
-
-        if self._current_user.playing_now:
-            playing_match = await Match.get_or_none(white_player=self._current_user) or await Match.get_or_none(
-                black_player=self._current_user)
-            if playing_match.white_player != self._current_user.pk:
-                player2: WsManager = online_users[(await playing_match.white_player.get()).username]
-                playing_match.winner = 1
-            else:
-                player2 = online_users[(await playing_match.black_player.get()).username]
-                playing_match.winner = 2
-            playing_match.finished_at = datetime.now()
-            player2._current_user.all_games += 1
-            player2._current_user.wins += 1
-            self._current_user.all_games += 1
-            self._current_user.losses += 1
-            await playing_match.save()
-            await player2._current_user.save()
-            await self._current_user.save()
-            await player2.websocket.send_json(
-                {'event': 'player-offline', 'task_id': 0, 'forward_from': self._current_user.username, 'error': None}
-            )
+        if self._closed:
+            return
+        self._closed = True
+        self.outbox.stop()
+        await bus.unregister(self._current_user.username)
+        await spectators.leave_all(self)
+        await matchmaking.leave(self._current_user.username)
+
+        # playing_now of the session's user may be stale when the game ended without a frame from this socket
+        owner = await live_matches.owner_for(self._current_user) if self._current_user.playing_now else None
+        if owner is not None:
+            is_local = owner == self._current_user.username or owner in online_users
+            if is_local or not await bus.command(owner, 'match-forfeit', username=self._current_user.username):
+                playing_match = await live_matches.for_player(self._current_user)
+                if playing_match is not None:
+                    await live_matches.forfeit(playing_match, self._current_user)
+        live_matches.forget(self._current_user.pk)
 
         await self._current_user.update_status(offline=True)
         try:
@@ -122,37 +190,17 @@ class WsManager:
         except RuntimeError:
             pass
 
-    async def _check_auth(self) -> User:
-        headers = self.websocket.headers
-        access_token = headers.get('Authorization')
-        try:
-            payload = jwt.decode(access_token, SECRET_KEY, algorithms=[ALGORITHM])
-            username: str = payload.get("sub")
-            if username is None:
+    async def _check_auth(self) -> bool:
+        if self._username is None:
+            access_token = self.websocket.headers.get('Authorization')
+            claims = decode_access_token(access_token) if access_token else None
+            if claims is None:
                 return False
-        except InvalidTokenError:
+            self._username, self._session_expires = claims
+        elif time.time() >= self._session_expires:
             return False
-        user = await User.get_or_none(username=username)
+        user = await user_cache.get(self._username)
         if user is None:
             return False
         self._current_user = user
         return True
-
-    def on_event(self, event: str):
-        def wrapper(func):
-            if len(online_users) == 0:
-                ws_docs[func.__name__] = func.__annotations__
-                ws_docs[func.__name__].pop('event')
-                ws_docs[func.__name__].update({'event': str, 'task_id': int, 'forward_to': str})
-
-            async def decorated(json_data, task_id: int, receiver: User = None):
-                # try:
-                await func(event=Event(event, task_id, self.websocket, self._current_user, receiver), **json_data)
-                # except TypeError as e:
-                #     await self.websocket.send_json(
-                #         {'event': event, 'task_id': task_id, 'forward_from': 'server', 'error': str(e)})
-
-            self._ws_routes[event] = decorated
-            return decorated
-
-        return wrapper
@@ -0,0 +1,92 @@
+import asyncio
+from collections import OrderedDict
+from itertools import count
+
+from config import WS_SEND_QUEUE_SIZE, WS_SEND_OVERFLOW
+
+DROP_OLDEST, COALESCE, DISCONNECT = 'drop-oldest', 'coalesce', 'disconnect'
+
+
+class Outbox:
+    # Encoded frames are queued and sent by a single writer task, so a slow socket never blocks the sender.
+    # A frame queued with a key replaces a still unsent frame with the same key (e.g. state of one match).
+    # on_close is called when the connection has to be closed: overflow with the disconnect policy or a failed send
+    def __init__(self, websocket, on_close=None, maxsize: int = WS_SEND_QUEUE_SIZE,
+                 policy: str = WS_SEND_OVERFLOW):
+        self.websocket = websocket
+        self.maxsize = maxsize
+        self.policy = policy
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.max_depth = 0
+        self._on_close = on_close
+        self._frames: OrderedDict[object, str | bytes] = OrderedDict()
+        self._ids = count()
+        self._ready = asyncio.Event()
+        self._writer: asyncio.Task | None = None
+
+    @property
+    def depth(self) -> int:
+        return len(self._frames)
+
+    def start(self):
+        self._writer = asyncio.create_task(self._write())
+
+    def stop(self):
+        if self._writer is not None:
+            self._writer.cancel()
+            self._writer = None
+        self._frames.clear()
+
+    def put(self, frame: str | bytes, key=None):
+        if key is not None and key in self._frames:
+            self._frames[key] = frame
+            self.coalesced += 1
+            return
+        if len(self._frames) >= self.maxsize and not self._make_room():
+            return
+        self._frames[next(self._ids) if key is None else key] = frame
+        self.max_depth = max(self.max_depth, len(self._frames))
+        self._ready.set()
+
+    def _make_room(self) -> bool:
+        if self.policy == DISCONNECT:
+            self.dropped += 1
+            self._close()
+            return False
+        if self.policy == COALESCE:
+            # Keyed frames are state snapshots, the oldest one is the cheapest to lose
+            for frame_id in self._frames:
+                if not isinstance(frame_id, int):
+                    del self._frames[frame_id]
+                    self.dropped += 1
+                    return True
+        self._frames.popitem(last=False)
+        self.dropped += 1
+        return True
+
+    def _close(self):
+        if self._on_close is not None:
+            self._on_close()
+
+    async def _write(self):
+        try:
+            while True:
+                await self._ready.wait()
+                while self._frames:
+                    _, frame = self._frames.popitem(last=False)
+                    if isinstance(frame, bytes):
+                        await self.websocket.send_bytes(frame)
+                    else:
+                        await self.websocket.send_text(frame)
+                    self.sent += 1
+                self._ready.clear()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self._close()
+
+    def stats(self) -> dict:
+        return {'depth': self.depth, 'max_depth': self.max_depth, 'sent': self.sent, 'dropped': self.dropped,
+                'coalesced': self.coalesced}
@@ -1 +1 @@
-from . import users, admins, ws_chess
\ No newline at end of file
+from . import users, admins, ws_chess, leaderboards
\ No newline at end of file
@@ -1 +1 @@
-from . import admin_conf, users_control
\ No newline at end of file
+from . import admin_conf, users_control, matches, tournaments, ratings
\ No newline at end of file
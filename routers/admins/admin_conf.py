@@ -1,5 +1,7 @@
 from data import schemas, models
 from resources import CurrentSuperAdmin, APIResponse, APIException
+from resources.auth import password_pool_stats
+from resources.ws_bus import online_users
 from urls import admin_router
 
 
@@ -8,7 +10,7 @@ async def add_new_admin(super_admin: CurrentSuperAdmin, username: str):
     new_admin = await models.User.get_or_none(username=username)
     if new_admin and new_admin != super_admin:
         new_admin.is_admin = True
-        await new_admin.save()
+        await new_admin.save(update_fields=('is_admin',))
         return APIResponse('User promoted to admin successfully')
     raise APIException(404, 'User not found')
 
@@ -18,7 +20,23 @@ async def delete_admin(super_admin: CurrentSuperAdmin, username: str):
     admin = await models.User.get_or_none(username=username)
     if admin and admin != super_admin:
         admin.is_admin = False
-        await admin.save()
+        await admin.save(update_fields=('is_admin',))
         return APIResponse('Admin deleted successfully')
     raise APIException(404, 'Admin not found')
 
+
+@admin_router.get("/password-pool")
+async def get_password_pool_stats(super_admin: CurrentSuperAdmin):
+    return APIResponse('Password pool stats', **password_pool_stats)
+
+
+@admin_router.get("/ws-queues")
+async def get_ws_queue_stats(super_admin: CurrentSuperAdmin):
+    queues = {username: manager.outbox.stats() for username, manager in online_users.items()}
+    return APIResponse(
+        'Websocket send queue stats',
+        connections=len(queues),
+        total_depth=sum(stats['depth'] for stats in queues.values()),
+        total_dropped=sum(stats['dropped'] for stats in queues.values()),
+        queues=queues,
+    )
@@ -0,0 +1,18 @@
+import numpy as np
+
+from data import models
+from engine import batch
+from resources import CurrentAdmin, APIResponse
+from urls import admin_router
+
+
+@admin_router.get('/active-matches')
+async def get_active_matches(admin: CurrentAdmin):
+    matches = await models.Match.filter(winner=-1)
+    if not matches:
+        return APIResponse('No active matches', matches=[])
+    codes = batch.decode_boards([match.board for match in matches])
+    checks = batch.in_check(codes, np.array([match.now_turn for match in matches]))
+    return APIResponse('Active matches', matches=[
+        {'id': match.pk, 'now_turn': match.now_turn, 'in_check': bool(check)} for match, check in zip(matches, checks)
+    ])
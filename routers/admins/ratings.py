@@ -0,0 +1,16 @@
+from datetime import datetime, timedelta
+
+from resources import CurrentSuperAdmin, APIResponse, APIException
+from resources.ratings import ratings
+from urls import admin_router
+
+
+@admin_router.post('/rating-period')
+async def run_rating_period(admin: CurrentSuperAdmin, start: datetime = None, end: datetime = None):
+    # Defaults to the last 24 hours, meant to be called nightly
+    end = end or datetime.now()
+    start = start or end - timedelta(days=1)
+    if start >= end:
+        raise APIException(400, 'Rating period must end after it starts')
+    games = await ratings.rating_period(start, end)
+    return APIResponse('Glicko-2 ratings updated', games=games)
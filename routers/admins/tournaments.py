@@ -1,5 +1,6 @@
 from data import schemas, models
 from resources import CurrentAdmin, APIResponse, APIException
+from resources.tournaments import tournaments
 from urls import admin_router
 
 
@@ -9,5 +10,31 @@ async def start_tournament(admin: CurrentAdmin, tournament_data: schemas.StartTo
         raise APIException(400, 'Tournament finishing time must after start of tournament')
     tournament_data = tournament_data.model_dump()
     tournament_data['owner'] = admin
-    await models.Tournament.create(**tournament_data)
-    return APIResponse('Tournament started successfully')
+    tournament = await models.Tournament.create(**tournament_data)
+    return APIResponse('Tournament started successfully', tournament_id=tournament.pk)
+
+
+@admin_router.post('/pair-round')
+async def pair_round(admin: CurrentAdmin, tournament_id: int):
+    tournament = await models.Tournament.get_or_none(pk=tournament_id)
+    if not tournament:
+        raise APIException(404, 'Tournament not found')
+    if await models.Match.exists(tournament=tournament, winner=-1):
+        raise APIException(400, 'Previous round is not finished yet')
+    if len(await tournaments.standings(tournament.pk)) < 2:
+        raise APIException(400, 'Tournament needs at least 2 participants')
+    matches, bye = await tournaments.pair_round(tournament)
+    return APIResponse(f'Round {tournament.round} paired', bye=bye, matches=[
+        {'id': match.pk, 'white_player': match.white_player_id, 'black_player': match.black_player_id}
+        for match in matches
+    ])
+
+
+@admin_router.get('/tournament-standings')
+async def get_tournament_standings(admin: CurrentAdmin, tournament_id: int, limit: int = 100):
+    if not await models.Tournament.exists(pk=tournament_id):
+        raise APIException(404, 'Tournament not found')
+    standings = await tournaments.standings(tournament_id)
+    return APIResponse('Tournament standings', standings=[
+        {'user_id': standing.user_id, 'points': standing.points / 2} for standing in standings.ranking(limit)
+    ])
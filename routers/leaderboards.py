@@ -0,0 +1,33 @@
+from fastapi import Query
+
+from resources import APIResponse, APIException, CurrentSuperAdmin
+from resources.leaderboards import leaderboards, leaderboard_key
+from urls import main_router, admin_router
+
+
+@main_router.get('/leaderboard')
+async def get_leaderboard(country: str = None, tournament_id: int = None, limit: int = Query(100, ge=1, le=1000)):
+    key = leaderboard_key(country, tournament_id)
+    return APIResponse('Leaderboard', players=await leaderboards.top(key, limit))
+
+
+@main_router.get('/leaderboard/rank')
+async def get_leaderboard_rank(username: str, country: str = None, tournament_id: int = None):
+    rank = await leaderboards.rank(leaderboard_key(country, tournament_id), username)
+    if rank is None:
+        raise APIException(404, 'User is not on this leaderboard')
+    return APIResponse('Leaderboard rank', **rank)
+
+
+@main_router.get('/leaderboard/around')
+async def get_leaderboard_around(username: str, country: str = None, tournament_id: int = None,
+                                 count: int = Query(5, ge=1, le=50)):
+    players = await leaderboards.around(leaderboard_key(country, tournament_id), username, count)
+    if players is None:
+        raise APIException(404, 'User is not on this leaderboard')
+    return APIResponse('Players around the user', players=players)
+
+
+@admin_router.post('/rebuild-leaderboards')
+async def rebuild_leaderboards(admin: CurrentSuperAdmin):
+    return APIResponse('Leaderboards rebuilt', users=await leaderboards.rebuild())
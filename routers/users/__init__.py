@@ -1 +1 @@
-from . import signup, signin, change_data, getme
\ No newline at end of file
+from . import signup, signin, change_data, getme, tournaments
\ No newline at end of file
@@ -1,19 +1,23 @@
 from data import schemas
 from resources import APIException, APIResponse, CurrentUser
-from resources.auth import verify_password, get_password_hash
+from resources.auth import verify_password_async, get_password_hash_async
+from resources.leaderboards import leaderboards
 from urls import user_router
 
 
 @user_router.post('/edit')
 async def edit_user(changing_data: schemas.ChangeDataModel, user: CurrentUser):
     now_password = user.password
-    if verify_password(changing_data.old_password, now_password):
+    if await verify_password_async(changing_data.old_password, now_password):
         changing_data = changing_data.model_dump()
         changing_data.pop('old_password')
-        changing_data['password'] = get_password_hash(changing_data['password'])
+        changing_data['password'] = await get_password_hash_async(changing_data['password'])
+        old_country = user.country
         try:
             await user.update_from_dict(changing_data)
             await user.save()
+            if user.country and user.country != old_country:
+                await leaderboards.move_country(user.username, old_country, user.country)
             return APIResponse('User changed successfully')
         except Exception as e:
             raise APIException(400, str(e))
@@ -5,7 +5,7 @@ from fastapi.security import OAuth2PasswordRequestForm
 
 from data import models
 from resources import APIException
-from resources.auth import verify_password, create_access_token
+from resources.auth import verify_password_async, create_access_token
 from urls import user_router
 
 
@@ -14,6 +14,6 @@ async def signin_user(user: Annotated[OAuth2PasswordRequestForm, Depends()]):
     db_user = await models.User.get_or_none(username=user.username)
     if db_user:
         hashed_password = db_user.password
-        if verify_password(user.password, hashed_password):
+        if await verify_password_async(user.password, hashed_password):
             return create_access_token(user.username)
     raise APIException(404, 'User not found')
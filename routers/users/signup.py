@@ -1,14 +1,15 @@
 from data import schemas, models
-from resources.auth import get_password_hash
+from resources.auth import get_password_hash_async
 from urls import user_router
 from resources import APIResponse, APIException
 
 
 @user_router.post('/signup')
 async def signup_user(user: schemas.SignUpModel):
+    user_dict = user.model_dump()
+    # Hashed outside the try so a full password pool still answers 503
+    user_dict['password'] = await get_password_hash_async(user_dict['password'])
     try:
-        user_dict = user.model_dump()
-        user_dict['password'] = get_password_hash(user_dict['password'])
         await models.User.create(**user_dict)
         return APIResponse('User created successfully')
     except Exception as e:
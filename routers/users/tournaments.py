@@ -0,0 +1,18 @@
+import time
+
+from data import models
+from resources import CurrentUser, APIResponse, APIException
+from resources.tournaments import tournaments
+from urls import user_router
+
+
+@user_router.post('/join-tournament')
+async def join_tournament(user: CurrentUser, tournament_id: int):
+    tournament = await models.Tournament.get_or_none(pk=tournament_id)
+    if not tournament:
+        raise APIException(404, 'Tournament not found')
+    if tournament.finishing_at.timestamp() <= time.time():
+        raise APIException(400, 'Tournament is already finished')
+    if not await tournaments.join(tournament, user):
+        raise APIException(400, 'You have already joined this tournament')
+    return APIResponse('You joined the tournament')
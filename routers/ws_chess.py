@@ -1,10 +1,16 @@
-from aioredis import Redis
 from fastapi.websockets import WebSocket
 from starlette.requests import Request
+from tortoise.exceptions import ValidationError
 
-from config import render
-from data import models
-from resources.ws_exchange import WsManager, Event, online_users, ws_docs
+from config import render, MAX_OFFERS, TIME_CONTROLS
+from data import models, offers
+from engine import QUEEN
+from resources.live_matches import live_matches
+from resources.matchmaking import matchmaking
+from resources.spectators import spectators
+from resources.user_cache import user_cache
+from resources.ws_bus import bus, online_users
+from resources.ws_exchange import WsManager, Event, ws_docs, ws_router
 from urls import main_router
 
 
@@ -13,69 +19,157 @@ async def build_ws_docs(request: Request):
     return render(request, 'ws_docs.html', {'ws_docs': ws_docs})
 
 
-@main_router.websocket('/chess')
-async def chess_platform(websocket: WebSocket):
-    wsm = WsManager(websocket)
-
-    @wsm.on_event('message')
-    async def message_event(event: Event, text: str):
-        await event.forward(text=text)
-
-    @wsm.on_event('view-match')
-    async def view_match_event(event: Event, game_id: int):
-        match = await models.Match.get_or_none(pk=game_id)
-        if match:
-            if event.current_user.pk in [match.white_player, match.black_player]:
-                return await event.reply_exception('You are now playing this match')
-            elif match.pk not in wsm.viewing_matches:
-                wsm.viewing_matches.append(match.pk)
-                return await event.success()
-            return await event.reply_exception('You are viewing this match')
-        else:
-            await event.reply_exception('Match not found')
-
-    @wsm.on_event('play-offer')
-    async def play_offer_event(event: Event):
-        if not event.receiver:
-            return event.receiver_exc()
-        if event.current_user.playing_now:
-            return await event.reply_exception('You cannot send offer during playing chess')
-        if event.receiver.username not in online_users:
-            return await event.reply_exception('You cannot send offer to offline user')
-        if event.receiver.playing_now:
-            return await event.reply_exception('Offering user playing chess now')
-        redis: Redis = websocket.app.redis
-        receiver_offers = await event.receiver.get_offers(redis)
-        if event.current_user.pk in receiver_offers:
-            return await event.reply_exception('You have already sent offer to this user')
-        own_offers = await event.current_user.get_offers(redis)
-        if event.receiver.pk in own_offers:
-            return await event.reply_exception('This user has already sent offer to you')
-        if len(receiver_offers) == 5:
-            return await event.reply_exception('In this user have already 5 offers')
-        await event.receiver.add_offer(event.current_user, redis)
-        await event.forward()
-        await event.success()
-
-    @wsm.on_event('reject-offer')
-    async def reject_offer_event(event: Event):
-        if not event.receiver:
-            return event.receiver_exc()
-        redis: Redis = websocket.app.redis
-        offers = await event.current_user.get_offers(redis)
-        print(offers)
-        if event.receiver.pk in offers:
-            await redis.delete(f'offer:{event.receiver.pk}:{event.current_user.pk}')
-            await event.forward()
-            return await event.success()
-        await event.reply_exception('You do not have this offer')
-
-    @wsm.on_event('accept-offer')
-    async def accept_offer_event(event: Event):
-        redis: Redis = websocket.app.redis
-        offers = await event.current_user.get_offers(redis)
-        if event.receiver.pk in offers:
-            await event.forward()
+async def play_move(event: Event, match: models.Match, from_at: str, to_at: str, promotion: int):
+    if match.now_turn != live_matches.color_of(match, event.current_user):
+        return await event.reply_exception('It is not your turn')
+    try:
+        status = await live_matches.move(match, from_at, to_at, promotion)
+    except ValidationError as e:
+        return await event.reply_exception(str(e))
+    event.receiver = live_matches.opponent_of(match, event.current_user)
+    await event.forward(from_at=from_at, to_at=to_at, promotion=promotion, status=status, **match.clock_state())
+    await event.success()
+    # Spectators get the whole board so a coalesced update never leaves them out of sync
+    await spectators.broadcast(match.pk, {
+        'event': 'match-update', 'task_id': 0, 'forward_from': 'server', 'error': None, 'match_id': match.pk,
+        'from_at': from_at, 'to_at': to_at, 'promotion': promotion, 'board': match.board,
+        'now_turn': match.now_turn, 'status': status, **match.clock_state(),
+    })
+
+
+# Run on the worker owning the match when the mover is connected to another worker
+@bus.on_command('match-move')
+async def match_move_command(username: str, task_id: int, from_at: str, to_at: str, promotion: int):
+    user = await user_cache.get(username)
+    match = await live_matches.for_player(user)
+    event = Event('move', task_id, None, user)
+    if not match:
+        return await event.reply_exception('You are not playing now')
+    await play_move(event, match, from_at, to_at, promotion)
+
+
+@bus.on_command('match-forfeit')
+async def match_forfeit_command(username: str):
+    user = await user_cache.get(username)
+    match = await live_matches.for_player(user)
+    if match:
+        await live_matches.forfeit(match, user)
+
+
+@ws_router.on_event('message')
+async def message_event(event: Event, text: str):
+    await event.forward(text=text)
+
+
+@ws_router.on_event('view-match')
+async def view_match_event(event: Event, game_id: int):
+    match = await models.Match.get_or_none(pk=game_id)
+    if match:
+        if event.current_user.pk in [match.white_player_id, match.black_player_id]:
+            return await event.reply_exception('You are now playing this match')
+        elif await spectators.subscribe(match.pk, event.manager):
             return await event.success()
+        return await event.reply_exception('You are viewing this match')
+    else:
+        await event.reply_exception('Match not found')
+
+
+@ws_router.on_event('unview-match')
+async def unview_match_event(event: Event, game_id: int):
+    if not spectators.is_viewing(game_id, event.manager):
+        return await event.reply_exception('You are not viewing this match')
+    await spectators.unsubscribe(game_id, event.manager)
+    await event.success()
+
 
-    await wsm.socket_run()
+@ws_router.on_event('play-offer')
+async def play_offer_event(event: Event):
+    if not event.receiver:
+        return await event.receiver_exc()
+    if event.current_user.playing_now:
+        return await event.reply_exception('You cannot send offer during playing chess')
+    if not await bus.is_online(event.receiver.username):
+        return await event.reply_exception('You cannot send offer to offline user')
+    if event.receiver.playing_now:
+        return await event.reply_exception('Offering user playing chess now')
+    result = await event.receiver.add_offer(event.current_user)
+    if result == offers.ALREADY_SENT:
+        return await event.reply_exception('You have already sent offer to this user')
+    if result == offers.ALREADY_RECEIVED:
+        return await event.reply_exception('This user has already sent offer to you')
+    if result == offers.TOO_MANY:
+        return await event.reply_exception(f'In this user have already {MAX_OFFERS} offers')
+    await event.forward()
+    await event.success()
+
+
+@ws_router.on_event('reject-offer')
+async def reject_offer_event(event: Event):
+    if not event.receiver:
+        return await event.receiver_exc()
+    if await event.current_user.remove_offer(event.receiver):
+        await event.forward()
+        return await event.success()
+    await event.reply_exception('You do not have this offer')
+
+
+@ws_router.on_event('accept-offer')
+async def accept_offer_event(event: Event):
+    if not event.receiver:
+        return await event.receiver_exc()
+    if event.current_user.playing_now:
+        return await event.reply_exception('You cannot accept offer during playing chess')
+    if event.receiver.playing_now:
+        return await event.reply_exception('Offering user playing chess now')
+    # The inviter plays white and so owns the match, it has to be connected to run it
+    if not await bus.is_online(event.receiver.username):
+        return await event.reply_exception('Offering user is not online')
+    if not await event.current_user.remove_offer(event.receiver):
+        return await event.reply_exception('You do not have this offer')
+    await matchmaking.leave(event.current_user.username)
+    await matchmaking.leave(event.receiver.username)
+    # The player who sent the offer plays white
+    match = await live_matches.create(event.receiver, event.current_user)
+    await event.forward(match_id=match.pk, **match.clock_state())
+    await event.success(match_id=match.pk, **match.clock_state())
+
+
+@ws_router.on_event('seek')
+async def seek_event(event: Event, time_control: str):
+    if time_control not in TIME_CONTROLS:
+        return await event.reply_exception('Unknown time control')
+    if event.current_user.playing_now:
+        return await event.reply_exception('You cannot seek a match during playing chess')
+    if not await matchmaking.join(event.current_user, time_control):
+        return await event.reply_exception('You are already seeking a match')
+    await event.success()
+
+
+@ws_router.on_event('cancel-seek')
+async def cancel_seek_event(event: Event):
+    if not await matchmaking.leave(event.current_user.username):
+        return await event.reply_exception('You are not seeking a match')
+    await event.success()
+
+
+@ws_router.on_event('move')
+async def move_event(event: Event, from_at: str, to_at: str, promotion: int = QUEEN):
+    owner = await live_matches.owner_for(event.current_user)
+    if owner is None:
+        return await event.reply_exception('You are not playing now')
+    if owner not in online_users:
+        delivered = await bus.command(owner, 'match-move', username=event.current_user.username,
+                                      task_id=event.task_id, from_at=from_at, to_at=to_at, promotion=promotion)
+        if not delivered:
+            live_matches.forget(event.current_user.pk)
+            await event.reply_exception('Opponent is not online')
+        return
+    match = await live_matches.for_player(event.current_user)
+    if not match:
+        return await event.reply_exception('You are not playing now')
+    await play_move(event, match, from_at, to_at, promotion)
+
+
+@main_router.websocket('/chess')
+async def chess_platform(websocket: WebSocket):
+    await WsManager(websocket).socket_run()